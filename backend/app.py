@@ -8,7 +8,11 @@ import json
 import traceback
 import gzip
 import io
+import asyncio
+import hashlib
+import uuid
 from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 sys.path.insert(0, os.path.dirname(__file__))
 
@@ -23,9 +27,16 @@ import aiofiles
 
 from config import settings
 from logger import logger
-from cache import mcq_cache
+from cache import mcq_cache, generation_flights, text_cache
+from scheduler import upstream_client, upstream_scheduler
+from http_client import http_client
+from llm_cache import llm_cache
+from extraction import ExtractionError, parse_page_ranges, select_text, text_extractor
+from normalize import text_normalizer
 from rate_limiter import rate_limiter
-from mcq_core import extract_text, generate_balanced_mcqs, save_mcqs_txt, save_mcqs_pdf, save_mcqs_docx
+from co_mapping import co_index_registry
+from mcq_core import generate_balanced_mcqs, save_mcqs_txt, save_mcqs_pdf, save_mcqs_docx
+from jobs import JobQueue, JobStore, QueueFullError
 
 
 # ===================================================================
@@ -39,6 +50,14 @@ RESULTS_FOLDER = os.path.join(BASE_DIR, "results")
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
+job_queue = JobQueue(
+    JobStore(os.path.join(BASE_DIR, settings.job_db_path)),
+    workers=settings.job_workers,
+    max_queued=settings.job_queue_max_size,
+    retention_hours=settings.job_retention_hours,
+    purge_interval_seconds=settings.job_purge_interval_minutes * 60,
+)
+
 app = FastAPI(title="AI MCQ Generator", version="2.0.0")
 
 app.add_middleware(
@@ -59,6 +78,8 @@ class MCQGenerationRequest(BaseModel):
     total_questions: int = Field(..., ge=settings.min_questions, le=settings.max_questions)
     co_list: str
     topic_name: str = ""
+    pages: str = ""
+    section: str = ""
     
     @validator('total_questions')
     def validate_question_count(cls, v):
@@ -87,6 +108,21 @@ class MCQGenerationRequest(BaseModel):
         sanitized = re.sub(r'[^\w\-]', '_', v)
         return sanitized[:settings.max_topic_name_length]
     
+    @validator('pages')
+    def validate_pages(cls, v):
+        v = v.strip()
+        if len(v) > settings.max_page_spec_length:
+            raise ValueError('Page range is too long')
+        parse_page_ranges(v)  # Raises on malformed ranges
+        return v
+    
+    @validator('section')
+    def validate_section(cls, v):
+        v = " ".join(v.split())
+        if len(v) > settings.max_section_length:
+            raise ValueError(f'Section name must be at most {settings.max_section_length} characters')
+        return v
+    
     @validator('url_input')
     def validate_url(cls, v):
         if not v or not v.strip():
@@ -110,10 +146,9 @@ def allowed_file(filename: str) -> bool:
 async def extract_text_from_url(url: str) -> str:
     """Extract text from URL asynchronously"""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                resp.raise_for_status()
-                html = await resp.text()
+        async with http_client.session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+            resp.raise_for_status()
+            html = await resp.text()
         
         soup = BeautifulSoup(html, "html.parser")
         for tag in soup(["script", "style", "nav", "header", "footer", "aside"]):
@@ -127,16 +162,30 @@ async def extract_text_from_url(url: str) -> str:
         raise ValueError(f"Failed to extract data from URL: {e}")
 
 
-async def save_uploaded_file_streaming(file: UploadFile, filepath: str) -> None:
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds max_file_size_mb while streaming"""
+
+
+async def save_uploaded_file_streaming(file: UploadFile, filepath: str, max_bytes: int) -> str:
     """
     Save uploaded file using streaming to avoid memory issues
-    Handles large files efficiently
+    Hashes the content and enforces the size limit as chunks arrive
+    Returns the SHA-256 hex digest of the file
     """
+    digest = hashlib.sha256()
+    size = 0
     try:
         async with aiofiles.open(filepath, 'wb') as f:
             while chunk := await file.read(settings.chunk_size_bytes):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                digest.update(chunk)
                 await f.write(chunk)
-        logger.info(f"Saved uploaded file: {filepath}")
+        logger.info(f"Saved uploaded file: {filepath} ({size} bytes)")
+        return digest.hexdigest()
+    except UploadTooLargeError:
+        raise
     except Exception as e:
         logger.error(f"Failed to save file {filepath}: {e}")
         raise
@@ -150,6 +199,20 @@ def get_client_ip(request: Request) -> str:
     return request.client.host if request.client else "unknown"
 
 
+def get_client_key(request: Request) -> str:
+    """
+    Rate-limit and fairness key: a configured API token (X-API-Key or
+    Bearer) when presented, otherwise the client IP
+    """
+    token = request.headers.get("X-API-Key", "")
+    auth = request.headers.get("Authorization", "")
+    if not token and auth.lower().startswith("bearer "):
+        token = auth[7:].strip()
+    if token and token in settings.api_tokens:
+        return "token:" + hashlib.sha256(token.encode()).hexdigest()[:16]
+    return "ip:" + get_client_ip(request)
+
+
 def error_response(msg: str, status: int = 400) -> JSONResponse:
     """Create error response"""
     logger.warning(f"Error response: {msg} (status={status})")
@@ -174,21 +237,20 @@ async def health_check():
     
     # Check Groq API connectivity
     try:
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "Authorization": f"Bearer {settings.groq_api_key}",
-                "Content-Type": "application/json",
-            }
-            async with session.get(
-                "https://api.groq.com/openai/v1/models",
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=5)
-            ) as resp:
-                if resp.status == 200:
-                    health_status["groq_api"] = "up"
-                else:
-                    health_status["groq_api"] = "degraded"
-                    health_status["status"] = "degraded"
+        headers = {
+            "Authorization": f"Bearer {settings.groq_api_key}",
+            "Content-Type": "application/json",
+        }
+        async with http_client.session.get(
+            "https://api.groq.com/openai/v1/models",
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=5)
+        ) as resp:
+            if resp.status == 200:
+                health_status["groq_api"] = "up"
+            else:
+                health_status["groq_api"] = "degraded"
+                health_status["status"] = "degraded"
     except Exception as e:
         logger.error(f"Groq API health check failed: {e}")
         health_status["groq_api"] = "down"
@@ -198,6 +260,226 @@ async def health_check():
     return JSONResponse(health_status, status_code=status_code)
 
 
+# ===================================================================
+#                    GENERATION HELPERS
+# ===================================================================
+
+async def prepare_generation(
+    request: Request,
+    url_input: str,
+    total_questions: int,
+    co_list: str,
+    topic_name: str,
+    file: Optional[UploadFile],
+    pages: str = "",
+    section: str = "",
+) -> Union[JSONResponse, Dict[str, Any]]:
+    """
+    Rate-limit, validate and extract the reference text for a generation
+    Returns an error response, or a dict with text, co_entries, total,
+    base_name, client_ip, client_key and warnings
+    """
+    # Rate limiting
+    client_ip = get_client_ip(request)
+    client_key = get_client_key(request)
+    allowed, error_msg = rate_limiter.is_allowed(client_key)
+    if not allowed:
+        logger.warning(f"Rate limit exceeded for {client_key}")
+        return error_response(error_msg, 429)
+    
+    # Validate inputs using Pydantic
+    try:
+        validated = MCQGenerationRequest(
+            url_input=url_input,
+            total_questions=total_questions,
+            co_list=co_list,
+            topic_name=topic_name,
+            pages=pages,
+            section=section,
+        )
+    except Exception as e:
+        return error_response(f"Invalid input: {str(e)}", 400)
+    
+    # Extract text from URL or file
+    if validated.url_input:
+        try:
+            if validated.pages:
+                return error_response("Page ranges are only supported for PDF uploads", 400)
+            text, truncated = select_text(
+                await extract_text_from_url(validated.url_input),
+                validated.section, settings.extraction_max_tokens if validated.section else 0
+            )
+            if settings.text_normalization_enabled:
+                text = text_normalizer.normalize([text], source=validated.url_input, web=True)
+            base_name = validated.topic_name or "generated_from_url"
+        except Exception as e:
+            return error_response(f"Error fetching URL: {e}", 400)
+    else:
+        if not file or not file.filename:
+            return error_response("No file uploaded and no URL provided", 400)
+        
+        if not allowed_file(file.filename):
+            return error_response(
+                f"Invalid file type. Allowed: {', '.join(settings.allowed_extensions).upper()}",
+                400
+            )
+        
+        # Save file using streaming (hashed and size-checked on the way)
+        filename = secure_filename(file.filename)
+        ext = filename.rsplit(".", 1)[1].lower()
+        filepath = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{filename}")
+        if validated.pages and ext != "pdf":
+            return error_response("Page ranges are only supported for PDF uploads", 400)
+        selection = f"{validated.pages}|{validated.section}"
+        
+        try:
+            content_hash = await save_uploaded_file_streaming(
+                file, filepath, settings.max_file_size_mb * 1024 * 1024
+            )
+            # Identical uploads skip extraction entirely
+            text, truncated = text_cache.get(content_hash, ext, selection), False
+            if text is None:
+                text, truncated = await text_extractor.extract(
+                    filepath, parse_page_ranges(validated.pages), validated.section,
+                    source=filename
+                )
+                # A cut selection is re-extracted next time so its warning is repeated
+                if not truncated:
+                    text_cache.set(content_hash, ext, text, selection)
+            else:
+                logger.info(f"Extracted-text cache hit for {filename}")
+            base_name = validated.topic_name or filename.rsplit(".", 1)[0]
+        except UploadTooLargeError:
+            return error_response(
+                f"File too large. Maximum size: {settings.max_file_size_mb}MB",
+                400
+            )
+        except ExtractionError as e:
+            return error_response(str(e), 400)
+        except Exception as e:
+            logger.error(f"Text extraction failed: {e}")
+            return error_response(f"Error extracting text: {e}", 500)
+        finally:
+            # Clean up uploaded file
+            if os.path.exists(filepath):
+                try:
+                    os.remove(filepath)
+                except:
+                    pass
+    
+    if not text.strip():
+        return error_response("No text could be extracted from the selected content", 400)
+    
+    warnings = []
+    if truncated:
+        warnings.append(
+            f"The selected text exceeds {settings.extraction_max_tokens:,} tokens "
+            f"(EXTRACTION_MAX_TOKENS); only its beginning was used"
+        )
+    
+    # Parse COs
+    co_entries = [line.strip() for line in validated.co_list.split("\n") if line.strip()]
+    
+    return {
+        "text": text,
+        "co_entries": co_entries,
+        "total": validated.total_questions,
+        "base_name": base_name,
+        "client_ip": client_ip,
+        "client_key": client_key,
+        "warnings": warnings,
+    }
+
+
+def save_result_files(mapped_mcqs: List[Dict], base_name: str) -> Dict[str, str]:
+    """Save TXT/PDF/DOCX/JSON outputs; returns the response filename fields"""
+    # Generate timestamp and filenames
+    ist = timezone(timedelta(hours=5, minutes=30))
+    timestamp = datetime.now(ist).strftime("%Y%m%d_%H%M%S")
+    safe_base = secure_filename(base_name)
+    
+    txt_name = f"{safe_base}_{timestamp}.txt"
+    pdf_name = f"{safe_base}_{timestamp}.pdf"
+    json_name = f"{safe_base}_{timestamp}.json"
+    docx_name = f"{safe_base}_{timestamp}.docx"
+    
+    # Save files
+    save_mcqs_txt(mapped_mcqs, RESULTS_FOLDER, txt_name)
+    save_mcqs_pdf(mapped_mcqs, RESULTS_FOLDER, pdf_name)
+    save_mcqs_docx(mapped_mcqs, RESULTS_FOLDER, docx_name)
+    
+    with open(os.path.join(RESULTS_FOLDER, json_name), "w", encoding="utf-8") as f:
+        json.dump(mapped_mcqs, f, indent=4)
+    
+    return {
+        "txt_filename": txt_name,
+        "pdf_filename": pdf_name,
+        "json_filename": json_name,
+        "docx_filename": docx_name,
+    }
+
+
+async def generate_with_cache(prepared: Dict[str, Any], on_event=None) -> List[Dict]:
+    """
+    Mapped MCQs for a prepared request, from cache or freshly generated
+    Concurrent identical requests share one in-flight generation
+    """
+    text = prepared["text"]
+    co_entries = prepared["co_entries"]
+    total = prepared["total"]
+    
+    cached_result = mcq_cache.get(text, co_entries, total)
+    if cached_result:
+        logger.info(f"Cache hit for {prepared['client_ip']}")
+        return cached_result["mapped_questions"]
+    
+    # Upstream calls of this generation are queued fairly under this client
+    upstream_client.set(prepared["client_key"])
+    
+    async def generate(emit) -> Dict[str, Any]:
+        result = await generate_balanced_mcqs(
+            text, co_entries, total, on_event=emit, session=http_client.session
+        )
+        mcq_cache.set(text, co_entries, total, result)
+        logger.info(f"Generated and cached {len(result['mapped_questions'])} MCQs")
+        return result
+    
+    result = await generation_flights.do(
+        mcq_cache.key(text, co_entries, total), generate, on_event=on_event
+    )
+    return result["mapped_questions"]
+
+
+async def run_generation_job(job_id: str, prepared: Dict[str, Any]) -> Dict[str, Any]:
+    """Job queue handler: generate, save outputs and return the job result"""
+    on_event = lambda kind, payload: job_queue.record_event(job_id, kind, payload)
+    try:
+        mapped_mcqs = await generate_with_cache(prepared, on_event=on_event)
+    except Exception as e:
+        logger.error(f"Job {job_id} generation failed: {e}\n{traceback.format_exc()}")
+        raise RuntimeError(generation_error_message(e)[0]) from e
+    
+    job_queue.record_event(job_id, "progress", {"stage": "saving"})
+    return {
+        "mapped_mcqs": mapped_mcqs,
+        **save_result_files(mapped_mcqs, prepared["base_name"]),
+        "warnings": prepared["warnings"],
+    }
+
+
+def generation_error_message(e: Exception) -> Tuple[str, int]:
+    """User-facing message and status for a failed generation"""
+    err = str(e).lower()
+    if "rate" in err or "limit" in err:
+        return "AI rate limit reached. Please wait a minute and try again.", 429
+    return "Error generating MCQs. Please try again or reduce question count.", 500
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 # ===================================================================
 #                    MAIN GENERATION ENDPOINT
 # ===================================================================
@@ -210,143 +492,157 @@ async def generate_mcqs(
     co_list: str = Form(...),
     topic_name: str = Form(default=""),
     file: UploadFile = File(default=None),
+    async_mode: bool = Form(default=False),
+    pages: str = Form(default=""),
+    section: str = Form(default=""),
 ):
     """
     Generate MCQs with validation, rate limiting, and caching
+    With async_mode the request is queued and a job ID is returned at once
+    (202); poll /jobs/{job_id} for progress, partial MCQs and output files
+    pages ('45-80', '3,5-7') or section ('Unit 3') limits extraction to
+    that part of the document
     """
     try:
-        # Rate limiting
-        client_ip = get_client_ip(request)
-        allowed, error_msg = rate_limiter.is_allowed(client_ip)
-        if not allowed:
-            logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-            return error_response(error_msg, 429)
+        prepared = await prepare_generation(
+            request, url_input, total_questions, co_list, topic_name, file, pages, section
+        )
+        if isinstance(prepared, JSONResponse):
+            return prepared
         
-        # Validate inputs using Pydantic
-        try:
-            validated = MCQGenerationRequest(
-                url_input=url_input,
-                total_questions=total_questions,
-                co_list=co_list,
-                topic_name=topic_name
+        if async_mode:
+            try:
+                job_id = job_queue.submit(prepared)
+            except QueueFullError as e:
+                logger.warning(f"Rejected job from {prepared['client_ip']}: {e}")
+                return JSONResponse(
+                    {"error": "Server busy. Please try again shortly."},
+                    status_code=503,
+                    headers={"Retry-After": "30"},
+                )
+            return JSONResponse(
+                {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"},
+                status_code=202,
             )
+        
+        try:
+            mapped_mcqs = await generate_with_cache(prepared)
         except Exception as e:
-            return error_response(f"Invalid input: {str(e)}", 400)
+            logger.error(f"MCQ generation failed: {e}\n{traceback.format_exc()}")
+            return error_response(*generation_error_message(e))
         
-        # Extract text from URL or file
-        if validated.url_input:
-            try:
-                text = await extract_text_from_url(validated.url_input)
-                base_name = validated.topic_name or "generated_from_url"
-            except Exception as e:
-                return error_response(f"Error fetching URL: {e}", 400)
-        else:
-            if not file or not file.filename:
-                return error_response("No file uploaded and no URL provided", 400)
-            
-            if not allowed_file(file.filename):
-                return error_response(
-                    f"Invalid file type. Allowed: {', '.join(settings.allowed_extensions).upper()}",
-                    400
-                )
-            
-            # Check file size
-            file.file.seek(0, 2)  # Seek to end
-            file_size_mb = file.file.tell() / (1024 * 1024)
-            file.file.seek(0)  # Reset
-            
-            if file_size_mb > settings.max_file_size_mb:
-                return error_response(
-                    f"File too large. Maximum size: {settings.max_file_size_mb}MB",
-                    400
-                )
-            
-            # Save file using streaming
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            
-            try:
-                await save_uploaded_file_streaming(file, filepath)
-                text = extract_text(filepath)
-                base_name = validated.topic_name or filename.rsplit(".", 1)[0]
-            except Exception as e:
-                logger.error(f"Text extraction failed: {e}")
-                return error_response(f"Error extracting text: {e}", 500)
-            finally:
-                # Clean up uploaded file
-                if os.path.exists(filepath):
-                    try:
-                        os.remove(filepath)
-                    except:
-                        pass
+        try:
+            filenames = save_result_files(mapped_mcqs, prepared["base_name"])
+        except Exception as e:
+            logger.error(f"File saving failed: {e}")
+            return error_response("Error saving output files", 500)
         
-        # Parse COs
-        co_entries = [line.strip() for line in validated.co_list.split("\n") if line.strip()]
+        # Return response
+        return JSONResponse({
+            "mcqs_raw": "\n\n".join(m["question_block"] for m in mapped_mcqs),
+            "mapped_mcqs": mapped_mcqs,
+            **filenames,
+            "warnings": prepared["warnings"],
+        })
+    
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}\n{traceback.format_exc()}")
+        return error_response(f"Unexpected error: {str(e)}", 500)
+
+
+@app.post("/generate/stream")
+async def generate_mcqs_stream(
+    request: Request,
+    url_input: str = Form(default=""),
+    total_questions: int = Form(...),
+    co_list: str = Form(...),
+    topic_name: str = Form(default=""),
+    file: UploadFile = File(default=None),
+    pages: str = Form(default=""),
+    section: str = Form(default=""),
+):
+    """
+    Same inputs as /generate, answered as Server-Sent Events:
+    - mcq: each mapped MCQ (with CO and Bloom level) as soon as it is parsed
+    - progress: generation stage updates
+    - complete: final MCQ selection and output file names
+    - error: generation failed
+    Validation errors are returned as plain JSON before the stream starts
+    """
+    try:
+        prepared = await prepare_generation(
+            request, url_input, total_questions, co_list, topic_name, file, pages, section
+        )
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}\n{traceback.format_exc()}")
+        return error_response(f"Unexpected error: {str(e)}", 500)
+    if isinstance(prepared, JSONResponse):
+        return prepared
+    
+    text = prepared["text"]
+    co_entries = prepared["co_entries"]
+    total = prepared["total"]
+    
+    async def event_stream():
+        yield sse_event("progress", {"stage": "started", "total": total, "cos": len(co_entries)})
         
-        # Check cache
-        cached_result = mcq_cache.get(text, co_entries, validated.total_questions)
+        cached_result = mcq_cache.get(text, co_entries, total)
         if cached_result:
-            logger.info(f"Cache hit for {client_ip}")
+            logger.info(f"Cache hit for {prepared['client_ip']}")
             mapped_mcqs = cached_result["mapped_questions"]
+            for mcq in mapped_mcqs:
+                yield sse_event("mcq", mcq)
         else:
-            # Generate MCQs
-            try:
-                result = await generate_balanced_mcqs(text, co_entries, validated.total_questions)
-                mapped_mcqs = result.get("mapped_questions", [])
-                
-                # Cache result
-                mcq_cache.set(text, co_entries, validated.total_questions, result)
-                logger.info(f"Generated and cached {len(mapped_mcqs)} MCQs")
+            queue: asyncio.Queue = asyncio.Queue()
             
-            except Exception as e:
-                logger.error(f"MCQ generation failed: {e}\n{traceback.format_exc()}")
-                err = str(e).lower()
-                if "rate" in err or "limit" in err:
-                    return error_response(
-                        "AI rate limit reached. Please wait a minute and try again.",
-                        429
+            async def run_generation():
+                try:
+                    mapped = await generate_with_cache(
+                        prepared,
+                        on_event=lambda kind, payload: queue.put_nowait((kind, payload))
                     )
-                return error_response(
-                    "Error generating MCQs. Please try again or reduce question count.",
-                    500
-                )
-        
-        # Generate timestamp and filenames
-        ist = timezone(timedelta(hours=5, minutes=30))
-        timestamp = datetime.now(ist).strftime("%Y%m%d_%H%M%S")
-        safe_base = secure_filename(base_name)
-        
-        txt_name = f"{safe_base}_{timestamp}.txt"
-        pdf_name = f"{safe_base}_{timestamp}.pdf"
-        json_name = f"{safe_base}_{timestamp}.json"
-        docx_name = f"{safe_base}_{timestamp}.docx"
-        
-        # Save files
-        try:
-            save_mcqs_txt(mapped_mcqs, RESULTS_FOLDER, txt_name)
-            save_mcqs_pdf(mapped_mcqs, RESULTS_FOLDER, pdf_name)
-            save_mcqs_docx(mapped_mcqs, RESULTS_FOLDER, docx_name)
+                    queue.put_nowait(("_done", mapped))
+                except Exception as e:
+                    logger.error(f"MCQ generation failed: {e}\n{traceback.format_exc()}")
+                    queue.put_nowait(("_failed", e))
             
-            with open(os.path.join(RESULTS_FOLDER, json_name), "w", encoding="utf-8") as f:
-                json.dump(mapped_mcqs, f, indent=4)
+            task = asyncio.create_task(run_generation())
+            try:
+                while True:
+                    kind, payload = await queue.get()
+                    if kind == "_done":
+                        mapped_mcqs = payload
+                        break
+                    if kind == "_failed":
+                        message, status = generation_error_message(payload)
+                        yield sse_event("error", {"error": message, "status": status})
+                        return
+                    yield sse_event(kind, payload)
+            finally:
+                # Client went away mid-stream: stop the upstream fan-out
+                if not task.done():
+                    task.cancel()
         
+        yield sse_event("progress", {"stage": "saving", "count": len(mapped_mcqs)})
+        try:
+            filenames = save_result_files(mapped_mcqs, prepared["base_name"])
         except Exception as e:
             logger.error(f"File saving failed: {e}")
-            return error_response("Error saving output files", 500)
+            yield sse_event("error", {"error": "Error saving output files", "status": 500})
+            return
         
-        # Return response
-        return JSONResponse({
+        yield sse_event("complete", {
             "mcqs_raw": "\n\n".join(m["question_block"] for m in mapped_mcqs),
             "mapped_mcqs": mapped_mcqs,
-            "txt_filename": txt_name,
-            "pdf_filename": pdf_name,
-            "json_filename": json_name,
-            "docx_filename": docx_name,
+            **filenames,
+            "warnings": prepared["warnings"],
         })
     
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}\n{traceback.format_exc()}")
-        return error_response(f"Unexpected error: {str(e)}", 500)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ===================================================================
@@ -397,6 +693,38 @@ async def download_file(filename: str, compress: bool = False):
         return JSONResponse({"error": "Download failed"}, status_code=500)
 
 
+# ===================================================================
+#                         JOB STATUS
+# ===================================================================
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of an async generation job:
+    queued | running | done | failed, with progress, the MCQs produced so
+    far and, once done, the final MCQs and output file names
+    """
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return error_response("Job not found", 404)
+    
+    response = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+        "progress": job["progress"],
+        "partial_mcqs": job["partial_mcqs"],
+    }
+    if job["status"] == "done":
+        result = job["result"]
+        response.update(result)
+        response["mcqs_raw"] = "\n\n".join(m["question_block"] for m in result["mapped_mcqs"])
+    elif job["status"] == "failed":
+        response["error"] = job["error"]
+    return response
+
+
 # ===================================================================
 #                         ADMIN ENDPOINTS
 # ===================================================================
@@ -406,14 +734,27 @@ async def get_stats():
     """Get system statistics (for monitoring)"""
     return {
         "cache_size": mcq_cache.size(),
+        "cache": mcq_cache.stats(),
+        "text_cache": text_cache.stats(),
+        "extraction": text_extractor.stats(),
+        "normalization": text_normalizer.stats(),
+        "co_indexes": co_index_registry.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "jobs": job_queue.stats(),
+        "single_flight": generation_flights.stats(),
+        "upstream": upstream_scheduler.stats(),
+        "http_pool": http_client.stats(),
+        "llm_cache": llm_cache.stats(),
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
 
 
 @app.post("/admin/clear-cache")
 async def clear_cache():
-    """Clear MCQ cache (admin only)"""
+    """Clear MCQ, extracted-text and LLM response caches (admin only)"""
     mcq_cache.clear()
+    text_cache.clear()
+    llm_cache.clear()
     logger.info("Cache cleared")
     return {"message": "Cache cleared successfully"}
 
@@ -424,7 +765,11 @@ async def clear_cache():
 
 @app.on_event("startup")
 async def startup_event():
-    """Log startup"""
+    """Log startup, open the shared HTTP and extraction pools and start background workers"""
+    http_client.start()
+    text_extractor.start()
+    mcq_cache.start_sweeper(settings.cache_sweep_interval_seconds)
+    job_queue.start(run_generation_job)
     logger.info("=" * 60)
     logger.info("AI MCQ Generator API Started")
     logger.info(f"Model: {settings.groq_model}")
@@ -435,5 +780,9 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Log shutdown"""
+    """Stop background workers, close the HTTP and extraction pools and log shutdown"""
+    await job_queue.stop()
+    await mcq_cache.stop_sweeper()
+    await http_client.close()
+    text_extractor.shutdown()
     logger.info("AI MCQ Generator API Shutting Down")
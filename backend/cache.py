@@ -1,56 +1,268 @@
 """
 Simple in-memory cache for MCQ generation
 Reduces redundant API calls for identical content
+- LRU eviction bounded by entry count and approximate bytes
+- Storage in a pluggable state backend (process-local or shared SQLite)
+- TTL expiry with a periodic background sweeper
+- Extracted-text cache keyed by upload content hash
+- Single-flight coalescing of identical in-flight generations
 """
+import asyncio
 import hashlib
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+import json
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, Awaitable, Callable, List, Tuple
+
+from config import settings
+from logger import logger
+from state import state_backend
+
+
+# Characters of content encoded per hash update (bounds the temporary bytes copy)
+HASH_SLICE_CHARS = 64 * 1024
 
 
 class MCQCache:
-    """Simple in-memory cache with TTL support"""
+    """LRU cache with TTL, entry and byte bounds over a pluggable state backend"""
     
-    def __init__(self, ttl_minutes: int = 60):
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._ttl = timedelta(minutes=ttl_minutes)
+    def __init__(self, backend, ttl_minutes: int = 60, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self._backend = backend
+        self._ttl = ttl_minutes * 60
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._sweeper: Optional[asyncio.Task] = None
     
     def _get_hash(self, content: str, cos: list, count: int) -> str:
-        """Generate cache key from content + parameters"""
-        key_str = f"{content}_{sorted(cos)}_{count}"
-        return hashlib.sha256(key_str.encode()).hexdigest()[:16]
+        """Generate cache key from content + parameters (hashed incrementally)"""
+        h = hashlib.sha256()
+        for start in range(0, len(content), HASH_SLICE_CHARS):
+            h.update(content[start:start + HASH_SLICE_CHARS].encode())
+        for co in sorted(cos):
+            h.update(b"\0")
+            h.update(co.encode())
+        h.update(f"\0{count}".encode())
+        return h.hexdigest()[:16]
+    
+    def key(self, content: str, cos: list, count: int) -> str:
+        """Cache key for a request (also used to coalesce in-flight requests)"""
+        return self._get_hash(content, cos, count)
     
     def get(self, content: str, cos: list, count: int) -> Optional[Dict[str, Any]]:
         """Retrieve cached result if exists and not expired"""
-        key = self._get_hash(content, cos, count)
-        
-        if key not in self._cache:
-            return None
-        
-        entry = self._cache[key]
-        
-        # Check expiration
-        if datetime.now() - entry["timestamp"] > self._ttl:
-            del self._cache[key]
-            return None
-        
-        return entry["data"]
+        return self._backend.cache_get(self._get_hash(content, cos, count), time.time())
     
     def set(self, content: str, cos: list, count: int, data: Dict[str, Any]) -> None:
-        """Store result in cache"""
-        key = self._get_hash(content, cos, count)
-        self._cache[key] = {
-            "data": data,
-            "timestamp": datetime.now()
-        }
+        """Store result in cache, evicting least-recently-used entries if needed"""
+        size = len(json.dumps(data, default=str))
+        if size > self._max_bytes:
+            return
+        now = time.time()
+        self._backend.cache_set(
+            self._get_hash(content, cos, count), data, size, now, now + self._ttl,
+            self._max_entries, self._max_bytes
+        )
+    
+    def sweep(self) -> int:
+        """Drop all expired entries; returns how many were removed"""
+        return self._backend.cache_sweep(time.time())
+    
+    def start_sweeper(self, interval_seconds: int) -> None:
+        """Run sweep() periodically in the background (call from app startup)"""
+        async def run():
+            while True:
+                await asyncio.sleep(interval_seconds)
+                removed = self.sweep()
+                if removed:
+                    logger.info(f"Cache sweeper removed {removed} expired entries")
+        
+        self._sweeper = asyncio.create_task(run())
+    
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
     
     def clear(self) -> None:
         """Clear all cache entries"""
-        self._cache.clear()
+        self._backend.cache_clear()
     
     def size(self) -> int:
         """Get number of cached entries"""
-        return len(self._cache)
+        return self._backend.cache_stats()["entries"]
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current usage"""
+        stats = self._backend.cache_stats()
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "entries": stats["entries"],
+            "max_entries": self._max_entries,
+            "bytes": stats["bytes"],
+            "max_bytes": self._max_bytes,
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0,
+            "evictions": stats["evictions"],
+            "expirations": stats["expirations"],
+            "busy": stats.get("busy", 0),
+        }
+
+
+class ExtractedTextCache:
+    """
+    LRU cache of extracted document text keyed by file type + content hash
+    (+ page/section selection)
+    Content-addressed, so entries never go stale; bounded by total characters
+    """
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+    
+    def get(self, content_hash: str, ext: str, selection: str = "") -> Optional[str]:
+        key = f"{ext}:{content_hash}:{selection}"
+        text = self._cache.get(key)
+        if text is None:
+            self._misses += 1
+            return None
+        self._cache.move_to_end(key)
+        self._hits += 1
+        return text
+    
+    def set(self, content_hash: str, ext: str, text: str, selection: str = "") -> None:
+        if len(text) > self._max_bytes:
+            return
+        key = f"{ext}:{content_hash}:{selection}"
+        if key in self._cache:
+            self._bytes -= len(self._cache.pop(key))
+        self._cache[key] = text
+        self._bytes += len(text)
+        while self._bytes > self._max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._bytes -= len(evicted)
+            self._evictions += 1
+    
+    def clear(self) -> None:
+        self._cache.clear()
+        self._bytes = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._cache),
+            "bytes": self._bytes,
+            "max_bytes": self._max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "evictions": self._evictions,
+        }
+
+
+EventCallback = Callable[[str, Any], None]
+
+
+class _Flight:
+    """One shared in-flight generation and the requests waiting on it"""
+    
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0  # Requests that joined after the leader
+        self.refs = 0  # Requests currently awaiting the result
+        self.events: List[Tuple[str, Any]] = []
+        self.listeners: List[EventCallback] = []
+    
+    def emit(self, kind: str, payload: Any) -> None:
+        """Record a progress event and forward it to every attached request"""
+        self.events.append((kind, payload))
+        for listener in list(self.listeners):
+            listener(kind, payload)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical requests onto one in-flight call
+    Late joiners get the events emitted so far replayed, then live ones;
+    the shared call is cancelled only when every request has gone away
+    """
+    
+    def __init__(self, history: int = 50):
+        self._flights: Dict[str, _Flight] = {}
+        self._completed = 0
+        self._coalesced = 0
+        self._recent: deque = deque(maxlen=history)
+    
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[EventCallback], Awaitable[Any]],
+        on_event: Optional[EventCallback] = None,
+    ) -> Any:
+        """Run fn(emit) once per key at a time and share its result"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._lead(key, flight, fn))
+        else:
+            flight.waiters += 1
+            self._coalesced += 1
+            logger.info(f"Joined in-flight generation {key} ({flight.waiters} waiter(s))")
+            if on_event:
+                for kind, payload in flight.events:
+                    on_event(kind, payload)
+        
+        if on_event:
+            flight.listeners.append(on_event)
+        flight.refs += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.refs -= 1
+            if on_event:
+                flight.listeners.remove(on_event)
+            if flight.refs == 0 and not flight.task.done():
+                logger.info(f"All requests for {key} left; cancelling generation")
+                # Unregister now so a new request starts a fresh flight
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+    
+    async def _lead(self, key: str, flight: _Flight, fn: Callable[[EventCallback], Awaitable[Any]]) -> Any:
+        try:
+            return await fn(flight.emit)
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self._completed += 1
+            self._recent.append({"key": key, "waiters": flight.waiters})
+            logger.info(f"Generation {key} finished with {flight.waiters} waiter(s)")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": {key: f.waiters for key, f in self._flights.items()},
+            "completed_flights": self._completed,
+            "coalesced_requests": self._coalesced,
+            "recent_flights": list(self._recent),
+        }
 
 
 # Global cache instance
-mcq_cache = MCQCache(ttl_minutes=60)
+mcq_cache = MCQCache(
+    state_backend,
+    ttl_minutes=settings.cache_ttl_minutes,
+    max_entries=settings.cache_max_entries,
+    max_bytes=settings.cache_max_mb * 1024 * 1024,
+)
+
+# Global extracted-text cache (per process)
+text_cache = ExtractedTextCache(max_bytes=settings.text_cache_max_mb * 1024 * 1024)
+
+# Global single-flight registry for MCQ generation
+generation_flights = SingleFlight()
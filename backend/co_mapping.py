@@ -0,0 +1,281 @@
+"""
+Vectorized question -> Course Outcome mapping
+- One vocabulary per CO set; COs encoded once as a term x CO matrix
+- Questions encoded in chunks and scored against every CO with one matrix
+  product
+- COIndex: Jaccard over raw tokens (matches map_question_to_co in mcq_core)
+- WeightedCOIndex: TF-IDF cosine over stemmed, stopword-free terms
+- Best CO plus top-k alternatives per question
+- Process-wide LRU registry of compiled indexes keyed by CO-list hash
+"""
+import hashlib
+import math
+import re
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from config import settings
+
+
+_TOKEN_RE = re.compile(r"\b[a-z]+\b")
+
+# Questions encoded per matrix product (bounds the dense chunk's memory)
+BATCH_ROWS = 4096
+
+
+def _tokens(text: str) -> set:
+    return set(_TOKEN_RE.findall(text.lower()))
+
+
+class COIndex:
+    """Token incidence matrix for one CO list, reusable across questions"""
+
+    def __init__(self, co_list: Sequence[str]):
+        self.co_list = list(co_list)
+        token_sets = [_tokens(co) for co in self.co_list]
+        self._vocab: Dict[str, int] = {}
+        for tokens in token_sets:
+            for token in tokens:
+                self._vocab.setdefault(token, len(self._vocab))
+        # vocab x COs, 1 where the CO contains the token
+        self._co_matrix = np.zeros((len(self._vocab), len(self.co_list)), dtype=np.float32)
+        for j, tokens in enumerate(token_sets):
+            self._co_matrix[[self._vocab[t] for t in tokens], j] = 1.0
+        self._co_sizes = np.array([len(t) for t in token_sets], dtype=np.float64)
+
+    def scores(self, questions: Sequence[str]) -> np.ndarray:
+        """Jaccard similarity of every question with every CO (questions x COs)"""
+        out = np.zeros((len(questions), len(self.co_list)), dtype=np.float64)
+        vocab = self._vocab
+        for start in range(0, len(questions), BATCH_ROWS):
+            chunk = questions[start:start + BATCH_ROWS]
+            sizes = np.empty(len(chunk), dtype=np.float64)
+            rows: List[int] = []
+            cols: List[int] = []
+            for i, question in enumerate(chunk):
+                tokens = _tokens(question)
+                sizes[i] = len(tokens)
+                ids = [vocab[t] for t in tokens if t in vocab]
+                rows.extend([i] * len(ids))
+                cols.extend(ids)
+            encoded = np.zeros((len(chunk), len(vocab)), dtype=np.float32)
+            encoded[rows, cols] = 1.0
+            inter = (encoded @ self._co_matrix).astype(np.float64)
+            union = sizes[:, None] + self._co_sizes[None, :] - inter
+            np.divide(inter, union, out=out[start:start + len(chunk)], where=union > 0)
+        return out
+
+    def match(self, questions: Sequence[str], top_k: int = 0) -> List[Dict[str, Any]]:
+        """
+        Best CO for each question, plus up to top_k runner-up COs with a
+        non-zero score (best first; ties go to the earlier CO)
+        """
+        if not questions:
+            return []
+        scores = self.scores(questions)
+        ranked = np.argsort(-scores, axis=1, kind="stable")[:, :top_k + 1].tolist()
+        labels = [f"CO{j + 1}" for j in range(len(self.co_list))]
+        matches = []
+        for row, order in zip(np.round(scores, 4).tolist(), ranked):
+            best = order[0]
+            matches.append({
+                "mapped_co": labels[best],
+                "co_description": self.co_list[best],
+                "similarity_score": row[best],
+                "co_alternatives": [
+                    {"co": labels[j], "similarity_score": row[j]}
+                    for j in order[1:] if row[j] > 0
+                ],
+            })
+        return matches
+
+
+# ===================================================================
+#                  WEIGHTED (TF-IDF) MAPPING
+# ===================================================================
+
+_TERM_RE = re.compile(r"[a-z][a-z0-9]+")
+
+# English function words plus wording shared by most CO statements
+STOPWORDS = frozenset("""
+a about above after again all also an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from
+further had has have having here how i if in into is it its itself just may me might
+more most much must no nor not now of off on once only or other our out over own same
+shall should so some such than that the their them then there these they this those
+through to too under until up upon very was we were what when where which while who
+whom why will with within without would you your
+able ability basic concept concepts different given knowledge main real student
+students time understand understanding use used using various way ways
+""".split())
+
+# (suffix, replacement, minimum stem length), longest first
+_SUFFIXES = (
+    ("ational", "ate", 3), ("ation", "", 3), ("ness", "", 3), ("ied", "y", 3), ("ing", "", 3),
+    ("ion", "", 3), ("ive", "", 3), ("ity", "", 3), ("al", "", 5), ("ly", "", 3),
+    ("ed", "", 3),
+)
+_ES_AFTER = ("ss", "sh", "ch", "x", "z")
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """
+    Light suffix-stripping stemmer: plural, then up to two derivational
+    suffixes, then a final 'e' (queue/queues -> queu, recursive/recursion/
+    recursively -> recurs, sorting/sorted -> sort)
+    """
+    if word.endswith("ies") and len(word) > 4:
+        word = word[:-3] + "y"
+    elif word.endswith("es") and word[:-2].endswith(_ES_AFTER):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")) and len(word) > 3:
+        word = word[:-1]
+
+    for _ in range(2):
+        for suffix, replacement, min_stem in _SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+                word = word[:-len(suffix)] + replacement
+                if suffix in ("ing", "ed") and word[-1] == word[-2] and word[-1] not in "lsz":
+                    word = word[:-1]  # mapping -> map
+                break
+        else:
+            break
+
+    if len(word) > 4 and word.endswith("e"):
+        word = word[:-1]
+    return word
+
+
+def analyze(text: str) -> List[str]:
+    """Lowercase, drop stopwords and single letters, stem"""
+    return [stem(t) for t in _TERM_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class WeightedCOIndex(COIndex):
+    """
+    TF-IDF cosine similarity between questions and COs
+    IDF is computed across the CO set, so wording every CO shares counts
+    for little and the terms that tell COs apart dominate. The term x CO
+    weight matrix is the inverted index: one row of CO weights per term.
+    Question terms unknown to every CO get the highest IDF, so unrelated
+    wording lowers the score instead of being ignored.
+    """
+
+    def __init__(self, co_list: Sequence[str]):
+        self.co_list = list(co_list)
+        term_counts = [Counter(analyze(co)) for co in self.co_list]
+        doc_freq: Counter = Counter()
+        for counts in term_counts:
+            doc_freq.update(counts.keys())
+        n = len(self.co_list)
+        self._vocab = {term: i for i, term in enumerate(doc_freq)}
+        self._idf = np.array(
+            [math.log((1 + n) / (1 + doc_freq[t])) + 1.0 for t in self._vocab], dtype=np.float32
+        )
+        self._unknown_idf = math.log(1 + n) + 1.0
+        matrix = np.zeros((len(self._vocab), n), dtype=np.float32)
+        for j, counts in enumerate(term_counts):
+            for term, count in counts.items():
+                i = self._vocab[term]
+                matrix[i, j] = (1.0 + math.log(count)) * self._idf[i]
+        norms = np.linalg.norm(matrix, axis=0)
+        self._co_matrix = matrix / np.where(norms > 0, norms, 1.0)
+
+    def scores(self, questions: Sequence[str]) -> np.ndarray:
+        """Cosine similarity of every question with every CO (questions x COs)"""
+        out = np.zeros((len(questions), len(self.co_list)), dtype=np.float64)
+        vocab = self._vocab
+        unknown_sq = self._unknown_idf ** 2
+        for start in range(0, len(questions), BATCH_ROWS):
+            chunk = questions[start:start + BATCH_ROWS]
+            unknown = np.zeros(len(chunk), dtype=np.float64)
+            rows: List[int] = []
+            cols: List[int] = []
+            for i, question in enumerate(chunk):
+                terms = set(analyze(question))
+                ids = [vocab[t] for t in terms if t in vocab]
+                unknown[i] = len(terms) - len(ids)
+                rows.extend([i] * len(ids))
+                cols.extend(ids)
+            encoded = np.zeros((len(chunk), len(vocab)), dtype=np.float32)
+            encoded[rows, cols] = self._idf[cols]
+            norms = np.sqrt((encoded.astype(np.float64) ** 2).sum(axis=1) + unknown * unknown_sq)
+            dots = (encoded @ self._co_matrix).astype(np.float64)
+            np.divide(dots, norms[:, None], out=out[start:start + len(chunk)], where=norms[:, None] > 0)
+        return out
+
+
+def create_co_index(co_list: Sequence[str]) -> COIndex:
+    """Index for the configured CO_MAPPING_METHOD (tfidf | jaccard)"""
+    if settings.co_mapping_method == "jaccard":
+        return COIndex(co_list)
+    return WeightedCOIndex(co_list)
+
+
+class COIndexRegistry:
+    """
+    Bounded LRU of compiled CO indexes keyed by a hash of the CO list
+    (and mapping method), so repeat CO sets skip index construction
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self._entries: "OrderedDict[str, COIndex]" = OrderedDict()
+        self._max_entries = max(1, max_entries)
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def key(co_list: Sequence[str], method: str) -> str:
+        digest = hashlib.sha256(method.encode())
+        for co in co_list:
+            digest.update(b"\0")
+            digest.update(co.strip().encode())
+        return digest.hexdigest()[:16]
+
+    def get(self, co_list: Sequence[str]) -> COIndex:
+        """Compiled index for co_list, built on first use"""
+        key = self.key(co_list, settings.co_mapping_method)
+        index = self._entries.get(key)
+        if index is not None:
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return index
+        self._misses += 1
+        index = create_co_index([co.strip() for co in co_list])
+        self._entries[key] = index
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+        return index
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self._max_entries,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "evictions": self._evictions,
+        }
+
+
+# Global registry shared by every generation in this process
+co_index_registry = COIndexRegistry(settings.co_index_cache_size)
+
+
+def map_questions_to_cos_batch(
+    questions: Sequence[str],
+    co_list: Sequence[str],
+    top_k: int = 0
+) -> List[Dict[str, Any]]:
+    """Map many questions at once (index from the shared registry)"""
+    return co_index_registry.get(co_list).match(questions, top_k)
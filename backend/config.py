@@ -3,6 +3,8 @@ Configuration management for AI MCQ Generator
 Centralizes all configurable parameters
 """
 import os
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 
 
@@ -23,6 +25,20 @@ class Settings(BaseSettings):
     allowed_extensions: set = {"pdf", "txt", "docx"}
     chunk_size_bytes: int = 8192  # 8KB chunks for streaming
     
+    # Text Extraction (process pool, off the event loop)
+    extraction_workers: int = 2
+    extraction_timeout_seconds: int = 60  # Per document
+    extraction_memory_limit_mb: int = 1024  # Address-space cap per worker (POSIX)
+    extraction_pages_per_task: int = 20  # PDF pages parsed per worker task
+    extraction_max_tokens: int = 100_000  # Budget for a pages/section selection (0 = no limit)
+    max_page_spec_length: int = 100
+    max_section_length: int = 100
+    
+    # Text Normalization (boilerplate stripping before prompting)
+    text_normalization_enabled: bool = True
+    boilerplate_min_pages: int = 3  # Pages needed before headers/footers are detected
+    boilerplate_page_fraction: float = 0.3  # Share of pages a line must repeat on
+    
     # PDF Generation
     pdf_font_size: int = 9
     pdf_margin_mm: int = 15
@@ -30,6 +46,8 @@ class Settings(BaseSettings):
     # Rate Limiting
     rate_limit_requests_per_minute: int = 5
     rate_limit_requests_per_hour: int = 100
+    rate_limit_max_keys: int = 100_000  # Tracked clients before the oldest are dropped
+    api_tokens: set = set()  # Clients presenting one of these are limited per token, not per IP
     
     # Validation Limits
     min_questions: int = 1
@@ -43,6 +61,65 @@ class Settings(BaseSettings):
     llm_max_tokens: int = 2048
     llm_temperature: float = 0.7
     llm_timeout_seconds: int = 120
+    mcq_output_tokens: int = 110  # Estimated completion tokens per MCQ
+    llm_streaming_enabled: bool = True  # Stream completions and stop early
+    
+    # CO Mapping
+    co_mapping_method: Literal["tfidf", "jaccard"] = "tfidf"  # tfidf (stemmed, IDF-weighted cosine) | jaccard
+    co_alternatives_top_k: int = 2  # Runner-up COs reported per question
+    co_index_cache_size: int = 128  # Compiled CO sets kept per process
+    
+    # Context Retrieval (per-CO prompt context)
+    retrieval_enabled: bool = True
+    context_token_budget: int = 3000  # Max reference-text tokens per prompt
+    retrieval_chunk_tokens: int = 300  # Approximate size of each ranked chunk
+    
+    # Map-Reduce Generation (documents larger than the context window)
+    map_reduce_enabled: bool = True
+    map_reduce_threshold_tokens: int = 24000  # Switch to map-reduce above this size
+    map_reduce_max_sections_per_co: int = 4
+    map_reduce_concurrency: int = 8
+    
+    # Request Packing (many COs, few questions each)
+    request_packing_enabled: bool = True
+    pack_max_questions_per_co: int = 3  # COs at or below this are packed
+    max_cos_per_prompt: int = 5
+    groq_requests_per_minute: int = 30  # Upstream quota used to size packing
+    groq_tokens_per_minute: int = 12000
+    
+    # Shared State (MCQ cache + rate limiter)
+    state_backend: str = "local"  # local | sqlite (required for --workers > 1)
+    state_db_path: str = "state.db"  # Relative to the project root
+    state_busy_timeout_ms: int = 20  # Lock wait on the event loop; past it calls fail open
+    
+    # MCQ Result Cache
+    cache_ttl_minutes: int = 60
+    cache_max_entries: int = 256
+    cache_max_mb: int = 64  # Approximate serialized size of cached results
+    cache_sweep_interval_seconds: int = 60
+    text_cache_max_mb: int = 64  # Extracted upload text, keyed by content hash
+    
+    # LLM Response Cache (persistent, per prompt)
+    llm_cache_enabled: bool = True
+    llm_cache_path: str = "llm_cache.db"  # Relative to the project root
+    llm_cache_max_mb: int = 200
+    
+    # Upstream Scheduler (process-wide Groq call pacing)
+    upstream_initial_concurrency: int = 4
+    upstream_max_concurrency: int = 16
+    
+    # HTTP Connection Pool (shared aiohttp client)
+    http_pool_size: int = 100  # Total open connections
+    http_pool_per_host: int = 20  # Per host (Groq, fetched URLs)
+    http_dns_cache_seconds: int = 300
+    http_keepalive_seconds: int = 30
+    
+    # Background Jobs (async /generate)
+    job_workers: int = 2  # Concurrent generation jobs
+    job_queue_max_size: int = 20  # Waiting jobs before new ones are rejected
+    job_db_path: str = "jobs.db"  # Relative to the project root
+    job_retention_hours: int = 24
+    job_purge_interval_minutes: int = 60  # How often expired jobs are deleted
     
     class Config:
         env_file = ".env"
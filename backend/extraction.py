@@ -0,0 +1,498 @@
+"""
+Document text extraction off the event loop
+- Runs in a process pool so a large parse never blocks other requests
+- Large PDFs are split into page ranges parsed by parallel workers
+- DOCX read as a stream from word/document.xml (paragraphs and tables)
+- Per-document timeout and per-worker memory cap
+- Optional page-range / section selection, read lazily and stopped once the
+  selection ends or the token budget is full
+- Boilerplate normalization of the result (see normalize.py)
+"""
+import asyncio
+import multiprocessing
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pdfplumber
+
+from config import settings
+from logger import logger
+from normalize import text_normalizer
+from retrieval import CHARS_PER_TOKEN
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+
+class ExtractionError(Exception):
+    """Raised when a document cannot be extracted (limits hit, selection not found)"""
+
+
+# 1-based inclusive page ranges; None as the end means "to the last page"
+PageRanges = List[Tuple[int, Optional[int]]]
+
+_RANGE_RE = re.compile(r"^(\d+)\s*(?:-\s*(\d*))?$")
+
+# Table-of-contents lines: "Trees ....... 20" (leaders) or "Trees 20"
+_TOC_LEADER_RE = re.compile(r"(?:\.{2,}|…|(?:\s\.){2,})\s*\d{1,4}\s*$")
+_PAGE_REF_RE = re.compile(r"(?:^|\s)\d{1,4}\s*$")
+
+
+def parse_page_ranges(spec: str) -> Optional[PageRanges]:
+    """Parse '45-80', '3, 5-7' or '50-' (None when spec is empty)"""
+    if not spec or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        match = _RANGE_RE.match(part.strip())
+        if not match:
+            raise ValueError(f"Invalid page range: '{part.strip()}'")
+        start = int(match.group(1))
+        end = start if match.group(2) is None else (int(match.group(2)) if match.group(2) else None)
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"Invalid page range: '{part.strip()}'")
+        ranges.append((start, end))
+    return ranges
+
+
+def select_pages(ranges: Optional[PageRanges], total: int) -> List[int]:
+    """0-based page indices for the ranges, in order, clipped to the document"""
+    if ranges is None:
+        return list(range(total))
+    indices: List[int] = []
+    seen = set()
+    for start, end in ranges:
+        for i in range(start - 1, min(end or total, total)):
+            if i not in seen:
+                seen.add(i)
+                indices.append(i)
+    return indices
+
+
+class TextSelector:
+    """
+    Consumes page texts in order and keeps the requested part
+    - section: starts at the first line beginning with the heading; a heading
+      such as 'Unit 3' or 'Chapter IV' ends at the next 'Unit'/'Chapter' heading.
+      Headings with dotted leaders are table-of-contents entries and are
+      skipped, as is a heading followed by no text, or one ending in a page
+      number followed only by such lines, before the next heading.
+    - max_tokens: stops once this much text has been kept (0 = no limit)
+    done turns True as soon as nothing more needs to be read
+    """
+
+    def __init__(self, section: str = "", max_tokens: int = 0):
+        section = " ".join(section.split())
+        self._start_re = re.compile(re.escape(section) + r"\b", re.I) if section else None
+        self._end_re = None
+        kind = re.match(r"(\w+)\s+(?:\d+|[ivxlc]+|[a-z])\b", section, re.I)
+        if kind:
+            self._end_re = re.compile(rf"{re.escape(kind.group(1))}\s+(?:\d+|[ivxlc]+|[a-z])\b", re.I)
+        self._max_chars = max_tokens * CHARS_PER_TOKEN
+        self._inside = section == ""
+        self._has_body = False
+        self._toc_like = False
+        self._parts: List[str] = []
+        self._chars = 0
+        self.found = section == ""
+        self.truncated = False
+        self.done = False
+
+    def feed(self, text: str) -> bool:
+        """Add the next page's text; returns done"""
+        if self.done or not text:
+            return self.done
+        if self._start_re is not None:
+            text = self._filter_section(text)
+            if not text:
+                return self.done
+        self._keep(text)
+        return self.done
+
+    def _filter_section(self, text: str) -> str:
+        kept = []
+        for line in text.split("\n"):
+            head = line.lstrip()
+            if not self._inside:
+                start = self._start_re.match(head)
+                if start and not _TOC_LEADER_RE.search(head):
+                    self._inside = True
+                    self._has_body = False
+                    self._toc_like = bool(_PAGE_REF_RE.search(head, start.end()))
+                    kept = [line]
+                continue
+            if self._end_re is not None and self._end_re.match(head) and not self._start_re.match(head):
+                if not self._has_body:
+                    # Table of contents: look for the real heading
+                    self._parts, self._chars, kept = [], 0, []
+                    self._inside = self.found = False
+                    continue
+                self.found = True
+                self.done = True
+                break
+            kept.append(line)
+            if not self._has_body and head and not (self._toc_like and _PAGE_REF_RE.search(head)):
+                self._has_body = True
+        if self._inside:
+            self.found = True
+        return "\n".join(kept)
+
+    def _keep(self, text: str) -> None:
+        if self._max_chars and self._chars + len(text) + 1 > self._max_chars:
+            text = text[:max(0, self._max_chars - self._chars - 1)]
+            self.truncated = True
+            self.done = True
+        self._parts.append(text)
+        self._chars += len(text) + 1
+
+    def pages(self, section: str = "") -> List[str]:
+        """Kept text per page"""
+        if not self.found:
+            raise ExtractionError(f"Section '{section}' not found in the document")
+        if not any(part.strip() for part in self._parts):
+            raise ExtractionError("No text found in the selected pages or section")
+        return self._parts
+
+    def text(self, section: str = "") -> str:
+        """Kept text, one newline after each page"""
+        return "".join(page + "\n" for page in self.pages(section))
+
+
+def select_text(text: str, section: str = "", max_tokens: int = 0) -> Tuple[str, bool]:
+    """
+    Apply section selection and the token budget to already-extracted text
+    Returns: (text, truncated)
+    """
+    if not section and not max_tokens:
+        return text, False
+    selector = TextSelector(section, max_tokens)
+    selector.feed(text)
+    return selector.text(section), selector.truncated
+
+
+# ===================================================================
+#                  WORKER FUNCTIONS (run in pool processes)
+# ===================================================================
+
+def _limit_worker_memory(max_mb: int) -> None:
+    """Pool initializer: cap the worker's address space"""
+    if resource is None or max_mb <= 0:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = max_mb * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def pdf_page_count(file_path: str) -> int:
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def _iter_pages(pdf, indices: Iterable[int]) -> Iterator[str]:
+    for i in indices:
+        page = pdf.pages[i]
+        content = page.extract_text() or ""
+        page.close()  # Drop the page's parsed layout before the next one
+        yield content
+
+
+def iter_pdf_pages(file_path: str, ranges: Optional[PageRanges] = None) -> Iterator[str]:
+    """Lazily yield the text of each selected page; stop iterating to stop parsing"""
+    with pdfplumber.open(file_path) as pdf:
+        yield from _iter_pages(pdf, select_pages(ranges, len(pdf.pages)))
+
+
+def extract_pdf_pages(file_path: str, indices: List[int]) -> List[str]:
+    """Text of the given 0-based pages (one pool task)"""
+    with pdfplumber.open(file_path) as pdf:
+        return list(_iter_pages(pdf, indices))
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P, _W_T, _W_TAB, _W_BR, _W_CR = _W + "p", _W + "t", _W + "tab", _W + "br", _W + "cr"
+_W_BODY, _W_TBL, _W_TR, _W_TC = _W + "body", _W + "tbl", _W + "tr", _W + "tc"
+
+
+def iter_docx_blocks(file_path: str) -> Iterator[str]:
+    """
+    Stream the body of a DOCX in document order: one string per paragraph
+    and one per table row (cells joined with ' | ')
+    Parsed element by element from word/document.xml, so memory stays flat
+    """
+    paragraphs: List[List[str]] = []  # Open paragraphs (text boxes nest them)
+    cells: List[List[str]] = []       # Paragraph texts of open table cells
+    rows: List[List[str]] = []        # Cell texts of open table rows
+    body = None
+
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as xml:
+        for event, elem in ET.iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == _W_P:
+                    paragraphs.append([])
+                elif tag == _W_TC:
+                    cells.append([])
+                elif tag == _W_TR:
+                    rows.append([])
+                elif tag == _W_BODY:
+                    body = elem
+                continue
+
+            if tag == _W_T:
+                if paragraphs and elem.text:
+                    paragraphs[-1].append(elem.text)
+            elif tag == _W_TAB:
+                if paragraphs:
+                    paragraphs[-1].append("\t")
+            elif tag in (_W_BR, _W_CR):
+                if paragraphs:
+                    paragraphs[-1].append("\n")
+            elif tag == _W_P:
+                text = "".join(paragraphs.pop())
+                if cells:
+                    cells[-1].append(text)
+                else:
+                    yield text
+                elem.clear()
+                if body is not None and not paragraphs and not cells:
+                    body.clear()  # Drop finished top-level elements
+            elif tag == _W_TC:
+                rows[-1].append(" ".join(t for t in cells.pop() if t))
+            elif tag == _W_TR:
+                line = " | ".join(c for c in rows.pop() if c)
+                if cells:
+                    cells[-1].append(line)  # Nested table
+                else:
+                    yield line
+                elem.clear()
+            elif tag == _W_TBL:
+                elem.clear()
+                if body is not None and not paragraphs and not cells:
+                    body.clear()
+
+
+def extract_text(file_path: str, ranges: Optional[PageRanges] = None, section: str = "",
+                 max_tokens: int = 0) -> str:
+    """Extract text from PDF, DOCX, or TXT files (synchronous)"""
+    return extract_selection(file_path, ranges, section, max_tokens)[0]
+
+
+def extract_selection(file_path: str, ranges: Optional[PageRanges] = None, section: str = "",
+                      max_tokens: int = 0) -> Tuple[str, bool]:
+    """extract_text that also reports whether the token budget cut the text"""
+    ext = file_path.lower().split(".")[-1]
+
+    try:
+        if ext == "pdf":
+            selector = TextSelector(section, max_tokens)
+            for content in iter_pdf_pages(file_path, ranges):
+                if selector.feed(content):
+                    break
+            return selector.text(section), selector.truncated
+
+        elif ext == "docx":
+            selector = TextSelector(section, max_tokens)
+            for block in iter_docx_blocks(file_path):
+                if selector.feed(block):
+                    break
+            return selector.text(section), selector.truncated
+
+        elif ext == "txt":
+            with open(file_path, "r", encoding="utf-8") as f:
+                return select_text(f.read(), section, max_tokens)
+
+        else:
+            raise ValueError(f"Unsupported file format: {ext}")
+
+    except Exception as e:
+        logger.error(f"Text extraction failed for {file_path}: {e}")
+        raise
+
+
+# ===================================================================
+#                         PROCESS POOL
+# ===================================================================
+
+class TextExtractor:
+    """
+    Process pool for upload extraction
+    Workers are spawned (not forked) so they start clean and the memory cap
+    applies to the parse alone. A timeout or a crashed worker retires the
+    pool: new extractions get a fresh one, and the old pool (with its stuck
+    worker) is killed once the extractions still using it have finished.
+    """
+
+    def __init__(self, workers: int, timeout_seconds: float, memory_limit_mb: int,
+                 pages_per_task: int, max_tokens: int = 0):
+        self._workers = max(1, workers)
+        self._timeout = timeout_seconds
+        self._memory_limit_mb = memory_limit_mb
+        self._pages_per_task = max(1, pages_per_task)
+        self._max_tokens = max_tokens
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._in_flight: Dict[ProcessPoolExecutor, int] = {}  # pool -> running extractions
+        self._retired: set = set()
+        self._extractions = 0
+        self._parallel_pdfs = 0
+        self._pages_parsed = 0
+        self._pages_skipped = 0
+        self._timeouts = 0
+        self._failures = 0
+        self._truncated = 0
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_limit_worker_memory,
+                initargs=(self._memory_limit_mb,),
+            )
+        return self._pool
+
+    def start(self) -> None:
+        """Create the pool eagerly (app startup); workers spawn on first use"""
+        self._ensure_pool()
+
+    def _retire_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Stop handing out a stuck or broken pool; it is killed once idle"""
+        if self._pool is pool:
+            self._pool = None
+        self._retired.add(pool)
+        if not self._in_flight.get(pool):
+            self._kill_pool(pool)
+
+    def _release_pool(self, pool: ProcessPoolExecutor) -> None:
+        self._in_flight[pool] -= 1
+        if self._in_flight[pool] == 0:
+            del self._in_flight[pool]
+            if pool in self._retired:
+                self._kill_pool(pool)
+
+    def _kill_pool(self, pool: ProcessPoolExecutor) -> None:
+        self._retired.discard(pool)
+        # ProcessPoolExecutor has no public way to stop a running task
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        for pool in list(self._retired):
+            self._kill_pool(pool)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def extract(self, file_path: str, ranges: Optional[PageRanges] = None,
+                      section: str = "", source: str = "") -> Tuple[str, bool]:
+        """
+        Extract text in the pool, enforcing the timeout and memory cap
+        The token budget only applies to a page range or section selection;
+        whole documents are read in full (large ones go through map-reduce)
+        Returns: (text, truncated)
+        """
+        max_tokens = self._max_tokens if ranges or section else 0
+        pool = self._ensure_pool()
+        self._in_flight[pool] = self._in_flight.get(pool, 0) + 1
+        try:
+            pages, truncated = await asyncio.wait_for(
+                self._extract(pool, file_path, ranges, section, max_tokens), self._timeout
+            )
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            self._retire_pool(pool)
+            raise ExtractionError(f"Text extraction timed out after {self._timeout}s")
+        except MemoryError:
+            self._failures += 1
+            raise ExtractionError(
+                f"Document needs more than {self._memory_limit_mb}MB to extract"
+            )
+        except BrokenProcessPool:
+            self._failures += 1
+            self._retire_pool(pool)
+            raise ExtractionError("Extraction worker crashed")
+        finally:
+            self._release_pool(pool)
+        self._extractions += 1
+        if truncated:
+            self._truncated += 1
+        if settings.text_normalization_enabled:
+            return text_normalizer.normalize(pages, source=source or os.path.basename(file_path)), truncated
+        return "".join(page + "\n" for page in pages), truncated
+
+    async def _extract(self, pool: ProcessPoolExecutor, file_path: str, ranges: Optional[PageRanges],
+                       section: str, max_tokens: int) -> Tuple[List[str], bool]:
+        """Selected text per page (a single 'page' for DOCX/TXT), and whether it was cut"""
+        loop = asyncio.get_running_loop()
+        if not file_path.lower().endswith(".pdf"):
+            text, truncated = await loop.run_in_executor(
+                pool, extract_selection, file_path, None, section, max_tokens
+            )
+            return [text], truncated
+
+        total = await loop.run_in_executor(pool, pdf_page_count, file_path)
+        indices = select_pages(ranges, total)
+        if not indices:
+            raise ExtractionError(f"Page range is outside the document ({total} pages)")
+        selector = TextSelector(section, max_tokens)
+        step = self._pages_per_task
+        wave = step * self._workers
+        parsed = 0
+        # Parse one wave of page ranges in parallel, then stop early if the
+        # selection has ended or the budget is full
+        for offset in range(0, len(indices), wave):
+            batch = indices[offset:offset + wave]
+            results = await asyncio.gather(*(
+                loop.run_in_executor(pool, extract_pdf_pages, file_path, batch[i:i + step])
+                for i in range(0, len(batch), step)
+            ))
+            parsed += len(batch)
+            if not selector.done:
+                for pages in results:
+                    for content in pages:
+                        if selector.feed(content):
+                            break
+            if selector.done:
+                break
+
+        self._pages_parsed += parsed
+        self._pages_skipped += total - parsed
+        if len(indices) > step:
+            self._parallel_pdfs += 1
+        logger.info(
+            f"Extracted {parsed}/{total} PDF pages"
+            + (" (token budget reached)" if selector.truncated else "")
+        )
+        return selector.pages(section), selector.truncated
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self._workers,
+            "extractions": self._extractions,
+            "parallel_pdfs": self._parallel_pdfs,
+            "pages_parsed": self._pages_parsed,
+            "pages_skipped": self._pages_skipped,
+            "timeouts": self._timeouts,
+            "failures": self._failures,
+            "retired_pools": len(self._retired),
+            "truncated": self._truncated,
+        }
+
+
+# Global extractor instance
+text_extractor = TextExtractor(
+    workers=settings.extraction_workers,
+    timeout_seconds=settings.extraction_timeout_seconds,
+    memory_limit_mb=settings.extraction_memory_limit_mb,
+    pages_per_task=settings.extraction_pages_per_task,
+    max_tokens=settings.extraction_max_tokens,
+)
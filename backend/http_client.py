@@ -0,0 +1,103 @@
+"""
+Shared HTTP client for Groq calls, URL fetching and health checks
+- One app-lifetime aiohttp session over a pooled keep-alive connector
+- Per-host connection limit and DNS cache
+- Connection reuse counters for monitoring
+"""
+import asyncio
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from config import settings
+from logger import logger
+
+
+class HTTPClient:
+    """Lazily created, explicitly closed shared aiohttp session"""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._requests = 0
+        self._connections_created = 0
+        self._connections_reused = 0
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self._requests += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self._connections_created += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self._connections_reused += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The shared session, created on first use in the running event loop
+        (recreated if the previous one belonged to a loop that has ended)
+        """
+        return self._ensure_session()
+
+    def start(self) -> None:
+        """Open the pool eagerly (app startup)"""
+        self._ensure_session()
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._connector = aiohttp.TCPConnector(
+                limit=settings.http_pool_size,
+                limit_per_host=settings.http_pool_per_host,
+                ttl_dns_cache=settings.http_dns_cache_seconds,
+                keepalive_timeout=settings.http_keepalive_seconds,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=self._connector,
+                trace_configs=[self._trace_config()],
+            )
+            self._loop = loop
+            logger.info(
+                f"HTTP pool opened: {settings.http_pool_size} connections, "
+                f"{settings.http_pool_per_host} per host"
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP pool closed")
+        self._session = None
+        self._connector = None
+        self._loop = None
+
+    def stats(self) -> Dict[str, Any]:
+        connector = self._connector
+        # aiohttp does not expose pool occupancy publicly
+        in_use = len(getattr(connector, "_acquired", ())) if connector else 0
+        idle = sum(len(c) for c in getattr(connector, "_conns", {}).values()) if connector else 0
+        opened = self._connections_created + self._connections_reused
+        return {
+            "requests": self._requests,
+            "connections_created": self._connections_created,
+            "connections_reused": self._connections_reused,
+            "reuse_ratio": round(self._connections_reused / opened, 3) if opened else 0.0,
+            "in_use": in_use,
+            "idle": idle,
+            "limit": settings.http_pool_size,
+            "limit_per_host": settings.http_pool_per_host,
+        }
+
+
+# Global client instance
+http_client = HTTPClient()
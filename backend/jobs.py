@@ -0,0 +1,312 @@
+"""
+Asynchronous generation jobs
+- Bounded in-process queue with a fixed worker pool (admission control)
+- Job status, progress, partial MCQs and artifacts kept in a SQLite table
+  (opened on first use, not at import)
+- Streamed MCQs are written in batches, not one commit per MCQ
+- Jobs whose worker process is gone are marked failed on startup
+- Finished jobs past their retention are purged periodically
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from logger import logger
+
+
+JobHandler = Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+# Provisional MCQs are buffered per job and written in one commit once this
+# many are waiting, or at the latest every MCQ_FLUSH_SECONDS (JobQueue)
+MCQ_FLUSH_BATCH = 10
+MCQ_FLUSH_SECONDS = 1.0
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    if not pid or pid == os.getpid():
+        # Unknown owner, or a previous run that had this same pid
+        return False
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on Windows; local
+        # development there runs a single worker anyway
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    SQLite-backed job table (status, progress, partial MCQs, result)
+    Buffered MCQs live in the memory of the process running the job: its own
+    reads see all of them, other worker processes see them once flushed
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._db: Optional[sqlite3.Connection] = None
+        self._pending: Dict[str, List[str]] = {}  # job_id -> MCQs not yet written
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = self._open()
+        return self._db
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                owner_pid INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS job_mcqs (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                mcq TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            );
+        """)
+        try:
+            # Tables created before jobs recorded their worker process
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner_pid INTEGER")
+        except sqlite3.OperationalError:
+            pass
+        conn.commit()
+        logger.info(f"Job store: {self._db_path}")
+        return conn
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def create(self, job_id: str) -> None:
+        now = self._now()
+        self._conn.execute(
+            "INSERT INTO jobs (id, status, created_at, updated_at, owner_pid) VALUES (?, 'queued', ?, ?, ?)",
+            (job_id, now, now, os.getpid())
+        )
+        self._conn.commit()
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        """Update status/progress/result/error (dict values stored as JSON)"""
+        fields = {k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in fields.items()}
+        fields["updated_at"] = self._now()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        self._write_pending(job_id)
+        self._conn.execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ?",
+            (*fields.values(), job_id)
+        )
+        self._conn.commit()
+
+    def add_mcq(self, job_id: str, mcq: Dict[str, Any]) -> None:
+        """
+        Append one provisional MCQ to the job's partial results
+        Buffered; written with the job's next update or read, once
+        MCQ_FLUSH_BATCH are waiting, or by flush_all()
+        """
+        pending = self._pending.setdefault(job_id, [])
+        pending.append(json.dumps(mcq))
+        if len(pending) >= MCQ_FLUSH_BATCH:
+            self.flush_mcqs(job_id)
+
+    def flush_mcqs(self, job_id: str) -> None:
+        """Write the job's buffered MCQs in one commit"""
+        if self._write_pending(job_id):
+            self._conn.commit()
+
+    def flush_all(self) -> None:
+        """Write every job's buffered MCQs in one commit"""
+        if sum(self._write_pending(job_id) for job_id in list(self._pending)):
+            self._conn.commit()
+
+    def _write_pending(self, job_id: str) -> int:
+        mcqs = self._pending.pop(job_id, None)
+        if not mcqs:
+            return 0
+        last = self._conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM job_mcqs WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        self._conn.executemany(
+            "INSERT INTO job_mcqs (job_id, seq, mcq) VALUES (?, ?, ?)",
+            [(job_id, last + i, mcq) for i, mcq in enumerate(mcqs, 1)]
+        )
+        return len(mcqs)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self.flush_mcqs(job_id)
+        row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        for key in ("progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        job["partial_mcqs"] = [
+            json.loads(r["mcq"]) for r in self._conn.execute(
+                "SELECT mcq FROM job_mcqs WHERE job_id = ? ORDER BY seq", (job_id,)
+            )
+        ]
+        return job
+
+    def fail_unfinished(self, reason: str) -> int:
+        """
+        Mark queued/running jobs whose worker process no longer exists as
+        failed (jobs of other live workers sharing the table are left alone)
+        """
+        orphaned = [
+            (reason, self._now(), row["id"])
+            for row in self._conn.execute(
+                "SELECT id, owner_pid FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            if not _process_alive(row["owner_pid"])
+        ]
+        self._conn.executemany(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?", orphaned
+        )
+        self._conn.commit()
+        return len(orphaned)
+
+    def purge_older_than(self, hours: int) -> int:
+        """Delete jobs (and their MCQs) not updated within the last hours"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+        self._conn.execute(
+            "DELETE FROM job_mcqs WHERE job_id IN (SELECT id FROM jobs WHERE updated_at < ?)",
+            (cutoff,)
+        )
+        removed = self._conn.execute("DELETE FROM jobs WHERE updated_at < ?", (cutoff,)).rowcount
+        self._conn.commit()
+        return removed
+
+
+class JobQueue:
+    """Bounded job queue drained by a fixed pool of asyncio workers"""
+
+    def __init__(self, store: JobStore, workers: int = 2, max_queued: int = 20, retention_hours: int = 24,
+                 purge_interval_seconds: float = 3600):
+        self.store = store
+        self._n_workers = workers
+        self._retention_hours = retention_hours
+        self._purge_interval = purge_interval_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._workers: List[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._purged = 0
+        self._handler: Optional[JobHandler] = None
+        self._running = 0
+
+    def start(self, handler: JobHandler) -> None:
+        """Start the worker pool (call from the app's startup hook)"""
+        self._handler = handler
+        interrupted = self.store.fail_unfinished("Interrupted by server restart")
+        if interrupted:
+            logger.warning(f"Marked {interrupted} unfinished job(s) as failed")
+        self._purge()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self._n_workers)]
+        self._sweeper = asyncio.create_task(self._sweep())
+        self._flusher = asyncio.create_task(self._flush())
+        logger.info(f"Job queue started: {self._n_workers} workers, capacity {self._queue.maxsize}")
+
+    async def stop(self) -> None:
+        tasks = self._workers + [task for task in (self._sweeper, self._flusher) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._sweeper = self._flusher = None
+        self.store.flush_all()
+
+    def _purge(self) -> None:
+        removed = self.store.purge_older_than(self._retention_hours)
+        self._purged += removed
+        if removed:
+            logger.info(f"Purged {removed} job(s) older than {self._retention_hours}h")
+
+    async def _sweep(self) -> None:
+        """Purge expired jobs for as long as the queue runs"""
+        while True:
+            await asyncio.sleep(self._purge_interval)
+            try:
+                self._purge()
+            except Exception as e:
+                logger.error(f"Job purge failed: {e}")
+
+    async def _flush(self) -> None:
+        """Bound how long buffered MCQs stay invisible to other worker processes"""
+        while True:
+            await asyncio.sleep(MCQ_FLUSH_SECONDS)
+            try:
+                self.store.flush_all()
+            except Exception as e:
+                logger.error(f"Job MCQ flush failed: {e}")
+
+    def submit(self, payload: Dict[str, Any]) -> str:
+        """
+        Queue a job and return its ID immediately
+        Raises QueueFullError when the queue is at capacity
+        """
+        if self._queue.full():
+            raise QueueFullError(f"Job queue is full ({self._queue.maxsize} waiting)")
+
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id)
+        self._queue.put_nowait((job_id, payload))
+        logger.info(f"Queued job {job_id} (depth {self._queue.qsize()})")
+        return job_id
+
+    def record_event(self, job_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        """on_event sink for generate_balanced_mcqs"""
+        if kind == "mcq":
+            self.store.add_mcq(job_id, payload)
+        elif kind == "progress":
+            self.store.update(job_id, progress=payload)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "running": self._running,
+            "capacity": self._queue.maxsize,
+            "workers": self._n_workers,
+            "purged": self._purged,
+        }
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job_id, payload = await self._queue.get()
+            self._running += 1
+            self.store.update(job_id, status="running")
+            try:
+                result = await self._handler(job_id, payload)
+                self.store.update(job_id, status="done", result=result)
+                logger.info(f"Worker {worker_id} finished job {job_id}")
+            except asyncio.CancelledError:
+                self.store.update(job_id, status="failed", error="Cancelled")
+                raise
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed job {job_id}: {e}")
+                self.store.update(job_id, status="failed", error=str(e))
+            finally:
+                self._running -= 1
+                self._queue.task_done()
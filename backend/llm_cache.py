@@ -0,0 +1,129 @@
+"""
+Persistent LLM response cache
+- One row per completion, keyed by model, temperature and prompt hash
+- Stored in a local SQLite file so completions survive restarts; the file
+  is opened on first use, not at import
+- Least-recently-used rows are evicted once the total size exceeds the bound
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from config import settings
+from logger import logger
+
+
+class LLMResponseCache:
+    """Size-bounded SQLite cache of raw completions"""
+
+    def __init__(self, db_path: str, max_bytes: int):
+        self._db_path = db_path
+        self._max_bytes = max_bytes
+        self._db: Optional[sqlite3.Connection] = None
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = self._open()
+        return self._db
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                temperature REAL NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)")
+        conn.commit()
+        self._bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        logger.info(f"LLM response cache: {self._db_path}")
+        return conn
+
+    @staticmethod
+    def key(model: str, prompt: str, temperature: float, occurrence: int = 0) -> str:
+        """
+        Cache key for one completion request
+        occurrence distinguishes repeats of the same prompt within one
+        generation (sub-batches, top-ups), which need distinct completions
+        """
+        return hashlib.sha256(f"{model}\0{temperature}\0{occurrence}\0{prompt}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return row[0]
+
+    def set(self, key: str, model: str, temperature: float, response: str) -> None:
+        size = len(response.encode("utf-8"))
+        if size > self._max_bytes:
+            return
+        now = time.time()
+        old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses "
+            "(key, model, temperature, response, size, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, model, temperature, response, size, now, now)
+        )
+        self._bytes += size - (old[0] if old else 0)
+        if self._bytes > self._max_bytes:
+            self._evict()
+        self._conn.commit()
+
+    def _evict(self) -> None:
+        """Drop least-recently-used rows until the cache fits its bound again"""
+        excess = self._bytes - self._max_bytes
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+            self._bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self._evictions += len(victims)
+        logger.info(f"LLM cache evicted {len(victims)} response(s)")
+
+    def clear(self) -> None:
+        self._conn.execute("DELETE FROM responses")
+        self._conn.commit()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self._hits + self._misses
+        return {
+            "entries": entries,
+            "bytes": self._bytes,
+            "max_bytes": self._max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            "evictions": self._evictions,
+        }
+
+
+# Global cache instance (file lives in the project root unless an absolute path is set)
+llm_cache = LLMResponseCache(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), settings.llm_cache_path),
+    max_bytes=settings.llm_cache_max_mb * 1024 * 1024,
+)
@@ -2,97 +2,102 @@
 Core MCQ generation logic with optimizations:
 - Parallel API calls using asyncio
 - Enhanced retry logic with exponential backoff
-- Optimized CO mapping with precomputed keyword sets
+- Vectorized batch CO mapping (TF-IDF weighted, top-k alternatives)
+- Retrieval-based per-CO context selection (BM25 over chunks)
+- Map-reduce generation for documents larger than the context window
+- Request packing of small per-CO counts into tagged multi-CO prompts
+- Streaming completions with incremental parsing and early cancellation
+- Process-wide upstream scheduling (rate-limit aware, fair across clients)
+- Shared pooled HTTP session (keep-alive, DNS cache) injected per generation
+- Persistent per-prompt response cache reused across requests and restarts
 - Comprehensive error handling and logging
-- Memory-efficient text extraction
+- Text extraction lives in extraction.py (process pool, page-parallel PDFs)
 """
 import os
 import re
+import json
 import asyncio
-from typing import Dict, List, Tuple, Optional
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Sequence, Tuple, Optional
 import aiohttp
-import docx
-import pdfplumber
 from fpdf import FPDF
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 from config import settings
 from logger import logger
+from retrieval import BM25Index, ContextSelector, chunk_text, estimate_tokens
+from scheduler import upstream_scheduler
+from http_client import http_client
+from llm_cache import llm_cache
+from extraction import extract_text  # Re-exported for existing callers
+from co_mapping import COIndex, co_index_registry
 
 
 # ===================================================================
-#                         TEXT EXTRACTION
+#                    BLOOM LEVEL DETECTION
 # ===================================================================
 
-def extract_text(file_path: str) -> str:
-    """Extract text from PDF, DOCX, or TXT files"""
-    ext = file_path.lower().split(".")[-1]
-    
-    try:
-        if ext == "pdf":
-            text = ""
-            with pdfplumber.open(file_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, 1):
-                    content = page.extract_text()
-                    if content:
-                        text += content + "\n"
-                    # Memory optimization: process in chunks
-                    if page_num % 10 == 0:
-                        logger.info(f"Processed {page_num} PDF pages")
-            return text
-        
-        elif ext == "docx":
-            doc = docx.Document(file_path)
-            return "\n".join(p.text for p in doc.paragraphs)
-        
-        elif ext == "txt":
-            with open(file_path, "r", encoding="utf-8") as f:
-                return f.read()
-        
-        else:
-            raise ValueError(f"Unsupported file format: {ext}")
-    
-    except Exception as e:
-        logger.error(f"Text extraction failed for {file_path}: {e}")
-        raise
+BLOOM_KEYWORDS = {
+    "Remember":   ["define", "recall", "list", "what", "when"],
+    "Understand": ["explain", "describe", "summarize", "interpret"],
+    "Apply":      ["apply", "use", "solve", "calculate", "determine"],
+    "Analyze":    ["analyze", "compare", "contrast", "distinguish"],
+    "Evaluate":   ["evaluate", "justify", "argue", "validate", "assess"],
+    "Create":     ["design", "create", "develop", "propose"]
+}
 
+# Fallbacks when no keyword is present
+BLOOM_HINTS = {"why": "Evaluate", "reason": "Evaluate", "how": "Analyze"}
+
+
+def _inflections(word: str) -> List[str]:
+    """Word plus its -s/-ed/-ing forms (define -> defines, defined, defining)"""
+    if word.endswith("e"):
+        return [word, word + "s", word + "d", word[:-1] + "ing"]
+    if word.endswith("y"):
+        return [word, word[:-1] + "ies", word[:-1] + "ied", word + "ing"]
+    suffix = "es" if word.endswith(("s", "sh", "ch", "x")) else "s"
+    return [word, word + suffix, word + "ed", word + "ing"]
+
+
+def _compile_bloom_table(keywords: Dict[str, List[str]], hints: Dict[str, str]) -> Dict[str, Tuple[int, str]]:
+    """Whole word -> (priority, level); keyword levels in order, hints last"""
+    table: Dict[str, Tuple[int, str]] = {}
+    for rank, (level, words) in enumerate(keywords.items()):
+        for word in words:
+            for form in _inflections(word):
+                table.setdefault(form, (rank, level))
+    for word, level in hints.items():
+        for form in _inflections(word):
+            table.setdefault(form, (len(keywords), level))
+    return table
+
+
+_BLOOM_TABLE = _compile_bloom_table(BLOOM_KEYWORDS, BLOOM_HINTS)
+_WORD_RE = re.compile(r"[a-z]+")
 
-# ===================================================================
-#                    BLOOM LEVEL DETECTION
-# ===================================================================
 
 def detect_bloom_level(question: str) -> str:
-    """Detect Bloom's Taxonomy level using keyword matching"""
-    q = question.lower()
-    tokens = re.findall(r'\b[a-z]+\b', q)
-    first_word = tokens[0] if tokens else ""
-    
-    bloom_keywords = {
-        "Remember":   ["define", "recall", "list", "what", "when"],
-        "Understand": ["explain", "describe", "summarize", "interpret"],
-        "Apply":      ["apply", "use", "solve", "calculate", "determine"],
-        "Analyze":    ["analyze", "compare", "contrast", "distinguish"],
-        "Evaluate":   ["evaluate", "justify", "argue", "validate", "assess"],
-        "Create":     ["design", "create", "develop", "propose"]
-    }
-    
-    # Check first word
-    for level, words in bloom_keywords.items():
-        if first_word in words:
-            return level
-    
-    # Check any word
-    for level, words in bloom_keywords.items():
-        if any(w in q for w in words):
-            return level
-    
-    # Heuristics
-    if "why" in q or "reason" in q:
-        return "Evaluate"
-    if "how" in q:
-        return "Analyze"
-    
-    return "Unclassified"
+    """
+    Detect Bloom's Taxonomy level using keyword matching
+    A keyword opening the question wins; otherwise the first level (in
+    BLOOM_KEYWORDS order) with a keyword anywhere, then the why/how hints.
+    Keywords match whole words only ("use" does not match "because").
+    """
+    words = _WORD_RE.findall(question.lower())
+    if not words:
+        return "Unclassified"
+    table = _BLOOM_TABLE
+    hit = table.get(words[0])
+    if hit is not None and hit[0] < len(BLOOM_KEYWORDS):
+        return hit[1]
+    hits = [table[w] for w in words if w in table]
+    return min(hits)[1] if hits else "Unclassified"
+
+
+def detect_bloom_levels_batch(questions: Sequence[str]) -> List[str]:
+    """Bloom level for each question"""
+    return [detect_bloom_level(q) for q in questions]
 
 
 # ===================================================================
@@ -123,6 +128,7 @@ def map_question_to_co(
 ) -> Tuple[str, str, float]:
     """
     Map question to best matching CO using precomputed keywords
+    (single question; batches go through the co_mapping indexes)
     Returns: (co_id, co_description, similarity_score)
     """
     q_keywords = _tokenize(question)
@@ -140,28 +146,176 @@ def map_question_to_co(
     return f"CO{best_idx + 1}", co_list[best_idx], round(best_score, 4)
 
 
+# Questions whose token sets overlap at least this much are duplicates
+DUPLICATE_SIMILARITY = 0.8
+
+
+def is_duplicate_question(question: str, seen_tokens: List[set]) -> bool:
+    """
+    Check a question against previously kept ones (Jaccard over tokens)
+    Non-duplicates are recorded in seen_tokens
+    """
+    tokens = _tokenize(question)
+    if any(_jaccard_similarity(tokens, seen) >= DUPLICATE_SIMILARITY for seen in seen_tokens):
+        return True
+    seen_tokens.append(tokens)
+    return False
+
+
 # ===================================================================
 #                     MCQ PARSER (Enhanced Logging)
 # ===================================================================
 
-def _extract_option(block: str, opt: str, next_opt: Optional[str]) -> str:
-    """Extract full text of an option from MCQ block"""
-    if next_opt:
-        stop = rf"(?=\s*{next_opt}\)\s|\s*Correct Answer:)"
+# Field label at the start of a line: "Question:", "Question 3:",
+# "Correct Answer:", "Answer:", options as A) A. (A) a), optionally **bold**
+# Lowercase labels only start the options in blocks without an uppercase
+# "A)" line, so "(a) push 1 / (b) pop" sub-items stay in the question
+_MCQ_LINE_RE = re.compile(
+    r"[ \t]*(?:\*\*)?[ \t]*(?:"
+    r"(?P<question>(?i:question))\b[^:]*:"
+    r"|(?P<answer>(?i:correct[ \t]+answer)\b(?:[ \t]*(?:\*\*)?[ \t]*[:-])?|(?i:answer)[ \t]*(?:\*\*)?[ \t]*:)"
+    r"|\(?(?P<option>[a-fA-F])[.)](?=[\s*]|$)"
+    r")(?:\*\*)?[ \t]*"
+)
+# Labels following text on the same line: "A) x  B) y", "D) x Correct Answer: B"
+_MCQ_INLINE_RE = re.compile(
+    r"[ \t](?:\(?(?P<option>[A-D])\)(?=[ \t])|(?P<answer>(?i:correct[ \t]+answer))\b[ \t]*:?)"
+)
+_UPPER_OPTION_RE = re.compile(r"^[ \t]*(?:\*\*)?[ \t]*\(?A[.)]", re.MULTILINE)
+_OPTION_LABELS = "ABCDEF"
+# The letter must stand alone: "B", "(B)", "B) Queue", "B." but not "a function..."
+_ANSWER_LETTER_RE = re.compile(r"(?:option[ \t]+)?\(?([a-d])\)?[ \t]*(?:[).:]|$)", re.IGNORECASE)
+# Rest of the '## MCQ' line: "1", "3:", "4."
+_MARKER_REST_RE = re.compile(r"^[ \t]*\d*[ \t]*[:.)-]?")
+
+# Optional CO tag written by packed prompts: "## MCQ [CO3]"
+_CO_TAG_RE = re.compile(r"^[ \t]*\[CO(\d+)\]", re.IGNORECASE)
+
+
+def _clean(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _first_text(lines: List[str]) -> str:
+    """First non-blank line (the answer may sit on the line after its label)"""
+    for line in lines:
+        if line.strip():
+            return line
+    return ""
+
+
+def _read_answer(text: str, options: Dict[str, str]) -> Optional[str]:
+    """
+    Answer letter from the text after 'Correct Answer:'
+    Accepts "B", "(B)", "B) <text>", "Option B", or the option text itself
+    """
+    text = _clean(text.replace("**", ""))
+    lowered = text.lower().rstrip(".")
+    for label, option in options.items():
+        if option.lower() == lowered:
+            return label
+    m = _ANSWER_LETTER_RE.match(text)
+    return m.group(1).upper() if m else None
+
+
+def _parse_mcq_block(
+    block: str,
+    block_num: int
+) -> Optional[Tuple[Optional[int], Tuple[str, str, Dict[str, str], str]]]:
+    """
+    Parse the text following one '## MCQ' marker
+    Returns: (co_index or None, (block, question, options, correct_answer)),
+    or None when the block is malformed
+    """
+    # Read and strip the CO tag (0-based index into the CO list)
+    co_index = None
+    tag_match = _CO_TAG_RE.match(block)
+    if tag_match:
+        co_index = int(tag_match.group(1)) - 1
+        block = block[tag_match.end():]
+    
+    # One pass over the lines; the text after each accepted label, up to
+    # the next one, belongs to that field
+    texts: Dict[str, List[str]] = {"preamble": []}
+    current = "preamble"
+    expected = 0  # Options must appear in order; a label may skip ahead
+    lowercase_starts = not _UPPER_OPTION_RE.search(block)
+    answer = None
+    lines = block.split("\n")
+    for n, line in enumerate(lines):
+        m = _MCQ_LINE_RE.match(line)
+        if m:
+            kind = m.lastgroup
+            if kind == "question":
+                if current == "preamble":
+                    current, line = "question", line[m.end():]
+            elif kind == "option":
+                label = m.group(kind)
+                index = _OPTION_LABELS.index(label.upper())
+                if index >= expected and (expected or lowercase_starts or label.isupper()):
+                    expected, current, line = index + 1, _OPTION_LABELS[index], line[m.end():]
+            elif expected:  # 'Answer' before any option is question text
+                answer = _first_text([line[m.end():]] + lines[n + 1:])
+                break
+        
+        # Further labels on the same line (cheap substring check first)
+        start, end = 0, None
+        if expected and (")" in line or "nswer" in line):
+            for m in _MCQ_INLINE_RE.finditer(line):
+                if m.lastgroup == "answer":
+                    answer = _first_text([line[m.end():]] + lines[n + 1:])
+                    end = m.start()
+                    break
+                index = _OPTION_LABELS.index(m.group("option"))
+                if index == expected:
+                    texts.setdefault(current, []).append(line[start:m.start()])
+                    expected, current, start = index + 1, _OPTION_LABELS[index], m.end()
+        texts.setdefault(current, []).append(line[start:end])
+        if answer is not None:
+            break
+    
+    # Extract question (unlabelled: the text between the marker and option A)
+    if "question" in texts:
+        question = _clean(" ".join(texts["question"]))
     else:
-        stop = rf"(?=\s*Correct Answer:)"
+        question = _clean(_MARKER_REST_RE.sub("", "\n".join(texts["preamble"]), count=1))
+    if not question:
+        logger.warning(f"Block {block_num}: Could not extract question")
+        return None
+    
+    # Options beyond D are dropped
+    options = {}
+    for opt in "ABCD":
+        text = _clean(" ".join(texts.get(opt, ())))
+        if text:
+            options[opt] = text
+    
+    # Validate: must have exactly 4 options
+    if len(options) < 4:
+        logger.warning(
+            f"Block {block_num}: Incomplete options {list(options.keys())} "
+            f"for question: {question[:60]!r}"
+        )
+        return None
+    
+    # Extract correct answer
+    correct = _read_answer(answer, options) if answer else None
+    if correct is None:
+        logger.warning(
+            f"Block {block_num}: Could not parse correct answer "
+            f"for question: {question[:60]!r}"
+        )
+        return None
     
-    pattern = rf"{opt}\)\s*(.*?){stop}"
-    m = re.search(pattern, block, re.DOTALL | re.IGNORECASE)
-    if not m:
-        return ""
-    return " ".join(m.group(1).split())
+    return co_index, (block.strip(), question, options, correct)
 
 
-def parse_mcqs(raw_text: str) -> List[Tuple[str, str, Dict[str, str], str]]:
+def parse_tagged_mcqs(
+    raw_text: str
+) -> List[Tuple[Optional[int], Tuple[str, str, Dict[str, str], str]]]:
     """
-    Parse raw MCQ text into structured format
-    Returns: List of (block, question, options, correct_answer)
+    Parse raw MCQ text, reading back the optional CO tag of each block
+    Returns: List of (co_index or None, (block, question, options, correct_answer))
     """
     raw_text = raw_text.replace("\r\n", "\n").replace("\r", "\n")
     mcq_blocks = raw_text.split("## MCQ")
@@ -171,56 +325,112 @@ def parse_mcqs(raw_text: str) -> List[Tuple[str, str, Dict[str, str], str]]:
         if not block.strip():
             continue
         
-        # Extract question
-        q_match = re.search(r"Question:\s*(.*?)(?=\n\s*A\))", block, re.DOTALL)
-        if not q_match:
-            logger.warning(f"Block {block_num}: Could not extract question")
-            continue
-        
-        question = " ".join(q_match.group(1).strip().split())
-        
-        # Extract options
-        opt_labels = ["A", "B", "C", "D"]
-        options = {}
-        for i, opt in enumerate(opt_labels):
-            next_opt = opt_labels[i + 1] if i + 1 < len(opt_labels) else None
-            text = _extract_option(block, opt, next_opt)
-            if text:
-                options[opt] = text
-        
-        # Validate: must have exactly 4 options
-        if len(options) < 4:
-            logger.warning(
-                f"Block {block_num}: Incomplete options {list(options.keys())} "
-                f"for question: {question[:60]!r}"
-            )
-            continue
-        
-        # Extract correct answer
-        c_match = re.search(
-            r"Correct Answer[:\s]*\(?([A-D])\)?",
-            block,
-            re.IGNORECASE
-        )
-        correct = c_match.group(1).upper() if c_match else "Unknown"
-        
-        if correct == "Unknown":
-            logger.warning(
-                f"Block {block_num}: Could not parse correct answer "
-                f"for question: {question[:60]!r}"
-            )
-            continue
-        
-        parsed_blocks.append((block.strip(), question, options, correct))
+        parsed = _parse_mcq_block(block, block_num)
+        if parsed:
+            parsed_blocks.append(parsed)
     
     logger.info(f"Successfully parsed {len(parsed_blocks)} MCQs from {len(mcq_blocks)-1} blocks")
     return parsed_blocks
 
 
+class IncrementalMCQParser:
+    """
+    Streaming counterpart of parse_tagged_mcqs
+    Text is fed as it arrives; each '## MCQ' block is parsed as soon as it
+    is complete, i.e. when the next marker arrives or its Correct Answer
+    line has been terminated
+    """
+    
+    _MARKER = "## MCQ"
+    _ANSWER_LINE_RE = re.compile(r"Correct Answer[\s:*-]*\w[^\n]*\n", re.IGNORECASE)
+    
+    def __init__(self):
+        self._buffer = ""
+        self._block_num = 0
+        self._completed: List[str] = []
+    
+    @property
+    def completed_text(self) -> str:
+        """Raw text of every block completed so far (no trailing partial block)"""
+        return "".join(self._completed)
+    
+    def _parse(self, block: str) -> List[Tuple]:
+        self._completed.append(block)
+        self._block_num += 1
+        parsed = _parse_mcq_block(block[len(self._MARKER):], self._block_num)
+        return [parsed] if parsed else []
+    
+    def feed(self, text: str) -> List[Tuple[Optional[int], Tuple]]:
+        """Add streamed text; returns MCQs completed by it"""
+        self._buffer += text.replace("\r\n", "\n").replace("\r", "\n")
+        completed = []
+        
+        while True:
+            start = self._buffer.find(self._MARKER)
+            if start < 0:
+                # Keep only what could be the start of a split marker
+                self._buffer = self._buffer[-(len(self._MARKER) - 1):]
+                break
+            
+            end = self._buffer.find(self._MARKER, start + len(self._MARKER))
+            if end < 0:
+                answer = self._ANSWER_LINE_RE.search(self._buffer, start)
+                if not answer:
+                    self._buffer = self._buffer[start:]
+                    break
+                end = answer.end()
+            
+            completed.extend(self._parse(self._buffer[start:end]))
+            self._buffer = self._buffer[end:]
+        
+        return completed
+    
+    def close(self) -> List[Tuple[Optional[int], Tuple]]:
+        """Flush the trailing block at end of stream"""
+        start = self._buffer.find(self._MARKER)
+        remainder, self._buffer = self._buffer, ""
+        return self._parse(remainder[start:]) if start >= 0 else []
+
+
+def tag_mcq_blocks(raw_text: str, co_index: int) -> str:
+    """Tag untagged '## MCQ' blocks with the CO that produced them"""
+    return re.sub(r"## MCQ(?![ \t]*\[CO\d+\])", f"## MCQ [CO{co_index + 1}]", raw_text)
+
+
+def parse_mcqs(raw_text: str) -> List[Tuple[str, str, Dict[str, str], str]]:
+    """
+    Parse raw MCQ text into structured format
+    Returns: List of (block, question, options, correct_answer)
+    """
+    return [parsed for _, parsed in parse_tagged_mcqs(raw_text)]
+
+
 # ===================================================================
 #            ASYNC MCQ GENERATION WITH RETRY LOGIC
 # ===================================================================
 
+_QUESTION_RULES = """- Use Bloom levels ONLY: Apply, Analyze, Evaluate.
+- Questions must clearly reflect the CO's terminology.
+- Do NOT generate purely theoretical/general questions.
+- Stick to the reference text context.
+
+- DO NOT refer to "given code", "above code", or "following code" unless code is explicitly present in the reference text.
+- Questions must be fully self-contained and understandable independently."""
+
+_FORMAT_RULES = """- EVERY MCQ MUST have EXACTLY 4 options: A, B, C, and D. Never skip any option.
+- CRITICAL: EACH OPTION (A, B, C, D) MUST FIT ON A SINGLE LINE.
+  Do NOT insert any line break or newline inside an option's text.
+- Correct Answer must be exactly one letter: A, B, C, or D. Nothing else.
+- Follow EXACTLY this format and nothing else:"""
+
+_MCQ_BODY_TEMPLATE = """Question: <question statement on one line>
+A) <full option text on one single line, no newlines>
+B) <full option text on one single line, no newlines>
+C) <full option text on one single line, no newlines>
+D) <full option text on one single line, no newlines>
+Correct Answer: <A or B or C or D>"""
+
+
 def _build_co_prompt(context: str, co_description: str, num_questions: int) -> str:
     """Build prompt for MCQ generation"""
     return f"""
@@ -232,28 +442,44 @@ CO Description:
 "{co_description}"
 
 STRICT RULES:
-- Use Bloom levels ONLY: Apply, Analyze, Evaluate.
-- Questions must clearly reflect the CO's terminology.
-- Do NOT generate purely theoretical/general questions.
-- Stick to the reference text context.
-
-- DO NOT refer to "given code", "above code", or "following code" unless code is explicitly present in the reference text.
-- Questions must be fully self-contained and understandable independently.
+{_QUESTION_RULES}
 
 - Start every MCQ with exactly '## MCQ' on its own line.
-- EVERY MCQ MUST have EXACTLY 4 options: A, B, C, and D. Never skip any option.
-- CRITICAL: EACH OPTION (A, B, C, D) MUST FIT ON A SINGLE LINE.
-  Do NOT insert any line break or newline inside an option's text.
-- Correct Answer must be exactly one letter: A, B, C, or D. Nothing else.
-- Follow EXACTLY this format and nothing else:
+{_FORMAT_RULES}
 
 ## MCQ
-Question: <question statement on one line>
-A) <full option text on one single line, no newlines>
-B) <full option text on one single line, no newlines>
-C) <full option text on one single line, no newlines>
-D) <full option text on one single line, no newlines>
-Correct Answer: <A or B or C or D>
+{_MCQ_BODY_TEMPLATE}
+
+REFERENCE TEXT:
+{context}
+"""
+
+
+def _build_packed_prompt(context: str, group: List[Tuple[int, str, int]]) -> str:
+    """
+    Build one prompt covering several COs
+    group: List of (co_index, co_description, num_questions)
+    """
+    co_lines = "\n".join(
+        f'- CO{co_idx + 1}: exactly {count} MCQs for "{co_desc}"'
+        for co_idx, co_desc, count in group
+    )
+    total = sum(count for _, _, count in group)
+    return f"""
+You are an expert exam-question designer.
+
+Generate exactly {total} MCQs in total, split across these Course Outcomes (COs):
+
+{co_lines}
+
+STRICT RULES:
+{_QUESTION_RULES}
+
+- Start every MCQ with exactly '## MCQ [CO<n>]' on its own line, where CO<n> is the CO it was written for.
+{_FORMAT_RULES}
+
+## MCQ [CO<n>]
+{_MCQ_BODY_TEMPLATE}
 
 REFERENCE TEXT:
 {context}
@@ -273,7 +499,7 @@ async def _call_groq_api_async(
 ) -> str:
     """
     Call Groq API with retry logic and exponential backoff
-    Raises exception after max retries
+    Admitted through the upstream scheduler; raises after max retries
     """
     body = {
         "model": settings.groq_model,
@@ -288,19 +514,21 @@ async def _call_groq_api_async(
     }
     
     try:
-        async with session.post(
-            settings.groq_api_url,
-            json=body,
-            headers=headers,
-            timeout=aiohttp.ClientTimeout(total=settings.llm_timeout_seconds)
-        ) as resp:
-            if resp.status == 429:
-                logger.warning(f"Rate limited for CO: {co_description[:50]}")
-                raise aiohttp.ClientError("Rate limit exceeded")
-            
-            resp.raise_for_status()
-            data = await resp.json()
-            return data["choices"][0]["message"]["content"]
+        async with upstream_scheduler.slot(estimate_tokens(prompt) + settings.llm_max_tokens) as slot:
+            async with session.post(
+                settings.groq_api_url,
+                json=body,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=settings.llm_timeout_seconds)
+            ) as resp:
+                slot.observe(resp.status, resp.headers)
+                if resp.status == 429:
+                    logger.warning(f"Rate limited for CO: {co_description[:50]}")
+                    raise aiohttp.ClientError("Rate limit exceeded")
+                
+                resp.raise_for_status()
+                data = await resp.json()
+                return data["choices"][0]["message"]["content"]
     
     except asyncio.TimeoutError:
         logger.error(f"Timeout calling Groq API for CO: {co_description[:50]}")
@@ -310,17 +538,212 @@ async def _call_groq_api_async(
         raise
 
 
+@retry(
+    stop=stop_after_attempt(settings.max_retries),
+    wait=wait_exponential(multiplier=1, min=2, max=10),
+    retry=retry_if_exception_type(aiohttp.ClientError),
+    reraise=True
+)
+async def _stream_groq_api_async(
+    session: aiohttp.ClientSession,
+    prompt: str,
+    co_description: str,
+    on_mcq: Callable[[Optional[int], Tuple], bool]
+) -> Tuple[str, bool]:
+    """
+    Call Groq API in streaming mode (SSE chunks) with incremental parsing
+    on_mcq is called for every complete MCQ; returning True cancels the
+    upstream stream. Returns (raw text received so far, complete), where
+    complete is True only for a completion that reached [DONE]; a stream
+    cancelled by the quota or broken off keeps the MCQs already delivered.
+    """
+    body = {
+        "model": settings.groq_model,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": settings.llm_max_tokens,
+        "temperature": settings.llm_temperature,
+        "stream": True,
+    }
+    
+    headers = {
+        "Authorization": f"Bearer {settings.groq_api_key}",
+        "Content-Type": "application/json",
+    }
+    
+    parser = IncrementalMCQParser()
+    pieces: List[str] = []
+    emitted = 0
+    finished = False
+    
+    def emit(completed: List[Tuple]) -> bool:
+        nonlocal emitted
+        stop = False
+        for co_index, parsed in completed:
+            emitted += 1
+            stop = on_mcq(co_index, parsed) or stop
+        return stop
+    
+    try:
+        async with upstream_scheduler.slot(estimate_tokens(prompt) + settings.llm_max_tokens) as slot:
+            async with session.post(
+                settings.groq_api_url,
+                json=body,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=settings.llm_timeout_seconds)
+            ) as resp:
+                slot.observe(resp.status, resp.headers)
+                if resp.status == 429:
+                    logger.warning(f"Rate limited for CO: {co_description[:50]}")
+                    raise aiohttp.ClientError("Rate limit exceeded")
+                
+                resp.raise_for_status()
+                
+                async for raw_line in resp.content:
+                    line = raw_line.decode("utf-8", errors="ignore").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        # Drain to EOF so the keep-alive connection goes back to the pool
+                        await resp.content.read()
+                        finished = True
+                        break
+                    
+                    delta = json.loads(payload)["choices"][0].get("delta", {}).get("content") or ""
+                    if not delta:
+                        continue
+                    pieces.append(delta)
+                    
+                    if emit(parser.feed(delta)):
+                        logger.info(
+                            f"Enough MCQs streamed for CO: {co_description[:50]}, "
+                            f"cancelling upstream after {emitted}"
+                        )
+                        resp.close()
+                        # Fewer MCQs than the prompt asked for: not a reusable completion
+                        return parser.completed_text, False
+                
+                emit(parser.close())
+                if not finished:
+                    logger.warning(f"Stream ended before [DONE] for CO: {co_description[:50]}")
+                return "".join(pieces), finished
+    
+    except asyncio.TimeoutError:
+        logger.error(f"Timeout streaming Groq API for CO: {co_description[:50]}")
+        if emitted:
+            return parser.completed_text, False
+        raise
+    except Exception as e:
+        logger.error(f"Streaming API call failed for CO '{co_description[:50]}': {e}")
+        if emitted:
+            # Keep the MCQs already delivered rather than regenerating them
+            return parser.completed_text, False
+        raise
+
+
+class StreamQuota:
+    """
+    Valid MCQs still wanted per CO, shared by all concurrent requests of
+    one generation so streams can stop as soon as their COs are covered
+    Only MCQs the pool would keep count: duplicates of each other or of
+    seen_tokens (the pool being topped up) are ignored
+    """
+    
+    def __init__(
+        self,
+        targets: List[int],
+        on_mcq: Optional[Callable[[Optional[int], Tuple], None]] = None,
+        seen_tokens: Optional[List[set]] = None
+    ):
+        self._remaining = list(targets)
+        self._on_mcq = on_mcq
+        self._seen_tokens = list(seen_tokens or [])
+    
+    def accept(self, co_index: Optional[int], parsed: Tuple) -> None:
+        """Record one streamed MCQ for its CO unless it is a duplicate"""
+        if is_duplicate_question(parsed[1], self._seen_tokens):
+            return
+        if co_index is not None and 0 <= co_index < len(self._remaining):
+            self._remaining[co_index] -= 1
+        if self._on_mcq:
+            self._on_mcq(co_index, parsed)
+    
+    def satisfied(self, co_indices: List[int]) -> bool:
+        """True when every given CO has reached its target"""
+        return all(self._remaining[i] <= 0 for i in co_indices)
+
+
+# How often each prompt has been issued in the current generation: identical
+# prompts (sub-batches of one CO, top-ups with the same deficit) are cached
+# as separate occurrences instead of all replaying the same completion
+_prompt_occurrences: ContextVar[Optional[Dict[str, int]]] = ContextVar("prompt_occurrences", default=None)
+
+
+async def _request_mcqs(
+    session: aiohttp.ClientSession,
+    prompt: str,
+    label: str,
+    co_indices: List[int],
+    quota: Optional[StreamQuota]
+) -> str:
+    """
+    Run one completion, streaming when enabled
+    Earlier completions of the same prompt are served from the response cache
+    Untagged blocks are attributed to the single CO of co_indices
+    """
+    default_index = co_indices[0] if len(co_indices) == 1 else None
+    
+    def on_mcq(co_index: Optional[int], parsed: Tuple) -> bool:
+        if quota is None:
+            return False
+        quota.accept(co_index if co_index is not None else default_index, parsed)
+        return quota.satisfied(co_indices)
+    
+    def replay(raw: str) -> None:
+        if quota is not None:
+            for co_index, parsed in parse_tagged_mcqs(raw):
+                on_mcq(co_index, parsed)
+    
+    cache_key = None
+    if settings.llm_cache_enabled:
+        occurrences = _prompt_occurrences.get()
+        occurrence = 0
+        if occurrences is not None:
+            occurrence = occurrences.get(prompt, 0)
+            occurrences[prompt] = occurrence + 1
+        cache_key = llm_cache.key(settings.groq_model, prompt, settings.llm_temperature, occurrence)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Response cache hit for CO: {label[:50]}")
+            replay(cached)
+            return cached
+    
+    if settings.llm_streaming_enabled:
+        result, complete = await _stream_groq_api_async(session, prompt, label, on_mcq)
+    else:
+        result, complete = await _call_groq_api_async(session, prompt, label), True
+        replay(result)
+    
+    # Only a completion that reached [DONE] is reusable (not one cancelled
+    # once the quota was met, or cut short by a timeout or error)
+    if cache_key and complete and result.strip():
+        llm_cache.set(cache_key, settings.groq_model, settings.llm_temperature, result)
+    return result
+
+
 async def generate_mcqs_for_co_async(
     session: aiohttp.ClientSession,
     text: str,
     co_description: str,
-    count: int
+    count: int,
+    co_index: int = 0,
+    quota: Optional[StreamQuota] = None
 ) -> str:
     """Generate MCQs for a single CO asynchronously"""
     prompt = _build_co_prompt(text, co_description, count)
     
     try:
-        result = await _call_groq_api_async(session, prompt, co_description)
+        result = await _request_mcqs(session, prompt, co_description, [co_index], quota)
         logger.info(f"Generated {count} MCQs for CO: {co_description[:50]}")
         return result
     except Exception as e:
@@ -328,52 +751,405 @@ async def generate_mcqs_for_co_async(
         return ""  # Return empty on failure
 
 
+# Keep completions safely below llm_max_tokens so the last MCQ is not cut off
+OUTPUT_TOKEN_HEADROOM = 0.85
+
+
+def _split_count(count: int, parts: int) -> List[int]:
+    """Split count into `parts` near-equal integers (largest first)"""
+    base, extra = divmod(count, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def max_mcqs_per_request() -> int:
+    """Largest MCQ count whose estimated completion fits llm_max_tokens"""
+    budget = settings.llm_max_tokens * OUTPUT_TOKEN_HEADROOM
+    return max(1, int(budget // settings.mcq_output_tokens))
+
+
+def split_by_output_budget(count: int) -> List[int]:
+    """Split a per-CO count into sub-batches that each fit the output budget"""
+    per_request = max_mcqs_per_request()
+    n_batches = max(1, -(-count // per_request))
+    return _split_count(count, n_batches)
+
+
+async def generate_packed_mcqs_async(
+    session: aiohttp.ClientSession,
+    text: str,
+    group: List[Tuple[int, str, int]],
+    quota: Optional[StreamQuota] = None
+) -> str:
+    """Generate MCQs for several small COs with one tagged prompt"""
+    prompt = _build_packed_prompt(text, group)
+    label = "+".join(f"CO{co_idx + 1}" for co_idx, _, _ in group)
+    
+    try:
+        result = await _request_mcqs(session, prompt, label, [co_idx for co_idx, _, _ in group], quota)
+        logger.info(f"Generated {sum(c for _, _, c in group)} packed MCQs for {label}")
+        return result
+    except Exception as e:
+        logger.error(f"Failed to generate packed MCQs for {label}: {e}")
+        return ""  # Return empty on failure
+
+
+def packing_factor(n_small_cos: int) -> int:
+    """
+    Max number of COs per packed prompt
+    Starts from max_cos_per_prompt and grows when the upstream request/token
+    rate limits could not absorb one request per CO within a minute
+    """
+    tokens_per_request = settings.context_token_budget + settings.llm_max_tokens
+    request_capacity = max(1, min(
+        settings.groq_requests_per_minute,
+        settings.groq_tokens_per_minute // tokens_per_request
+    ))
+    rate_needed = -(-n_small_cos // request_capacity)
+    return max(1, settings.max_cos_per_prompt, rate_needed)
+
+
+def plan_requests(questions_per_co: List[int]) -> List[List[Tuple[int, int]]]:
+    """
+    Plan upstream requests as groups of (co_index, buffered_count)
+    - Large COs are split into output-budgeted sub-batches (one CO each)
+    - Small COs are packed together up to the packing factor, as long as
+      the group's combined output still fits one completion
+    """
+    per_request = max_mcqs_per_request()
+    plan: List[List[Tuple[int, int]]] = []
+    small: List[Tuple[int, int]] = []
+    
+    for co_idx, count in enumerate(questions_per_co):
+        # Add 20% buffer to compensate for malformed questions
+        buffered_count = max(1, round(count * (1 + settings.generation_buffer)))
+        if settings.request_packing_enabled and buffered_count <= settings.pack_max_questions_per_co:
+            small.append((co_idx, buffered_count))
+        else:
+            plan.extend([(co_idx, batch)] for batch in split_by_output_budget(buffered_count))
+    
+    factor = packing_factor(len(small))
+    group: List[Tuple[int, int]] = []
+    for co_idx, count in small:
+        if group and (len(group) >= factor or sum(c for _, c in group) + count > per_request):
+            plan.append(group)
+            group = []
+        group.append((co_idx, count))
+    if group:
+        plan.append(group)
+    
+    return plan
+
+
 async def generate_all_mcqs_parallel(
     text: str,
     co_list: List[str],
-    questions_per_co: List[int]
+    questions_per_co: List[int],
+    selector: Optional[ContextSelector] = None,
+    quota: Optional[StreamQuota] = None,
+    session: Optional[aiohttp.ClientSession] = None
 ) -> str:
     """
     Generate MCQs for all COs in parallel using asyncio
     Major performance improvement: 5-10x faster than sequential
+    Each prompt carries only its retrieved context (see retrieval.py)
+    Large per-CO counts are split into concurrent sub-batches so no single
+    completion exceeds llm_max_tokens; small ones are packed into tagged
+    multi-CO prompts. Every returned block is tagged with its source CO.
     """
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        
-        for co, count in zip(co_list, questions_per_co):
-            # Add 20% buffer to compensate for malformed questions
-            buffered_count = max(1, round(count * (1 + settings.generation_buffer)))
-            logger.info(f"Scheduling {buffered_count} MCQs for CO (target: {count}, +20% buffer)")
-            
-            task = generate_mcqs_for_co_async(session, text, co, buffered_count)
-            tasks.append(task)
+    if selector is None:
+        selector = ContextSelector(text)
+    if quota is None:
+        quota = StreamQuota(questions_per_co)
+    if session is None:
+        session = http_client.session
+    
+    plan = plan_requests(questions_per_co)
+    logger.info(
+        f"Scheduling {sum(c for group in plan for _, c in group)} MCQs "
+        f"(+{settings.generation_buffer:.0%} buffer) in {len(plan)} request(s) "
+        f"for {len(co_list)} COs"
+    )
+    
+    tasks = []
+    
+    for group in plan:
+        if len(group) == 1:
+            co_idx, count = group[0]
+            co = co_list[co_idx]
+            tasks.append(generate_mcqs_for_co_async(
+                session, selector.select(co), co, count, co_idx, quota
+            ))
+        else:
+            packed = [(co_idx, co_list[co_idx], count) for co_idx, count in group]
+            context = selector.select(" ".join(co for _, co, _ in packed))
+            tasks.append(generate_packed_mcqs_async(session, context, packed, quota))
+    
+    # Execute all API calls in parallel
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # Filter out exceptions and combine results
+    all_raw = ""
+    for group, result in zip(plan, results):
+        if isinstance(result, Exception):
+            labels = ", ".join(f"CO{co_idx + 1}" for co_idx, _ in group)
+            logger.error(f"{labels} generation failed: {result}")
+        elif result:
+            if len(group) == 1:
+                result = tag_mcq_blocks(result, group[0][0])
+            all_raw += result + "\n\n"
+    
+    return all_raw
+
+
+# ===================================================================
+#         MCQ POOL (Dedupe, CO Attribution, Rebalancing)
+# ===================================================================
+
+class MCQPool:
+    """
+    Deduplicated parsed MCQs grouped by the CO whose prompt produced them
+    Blocks whose source CO is unknown (e.g. a packed prompt that dropped
+    its tag) are kept separately and only used to fill shortfalls
+    """
+    
+    def __init__(self, n_cos: int):
+        self.by_co: List[List[Tuple]] = [[] for _ in range(n_cos)]
+        self.unattributed: List[Tuple] = []
+        self._seen_tokens: List[set] = []
+    
+    def __len__(self) -> int:
+        return sum(len(pool) for pool in self.by_co) + len(self.unattributed)
+    
+    def add(self, co_index: Optional[int], parsed: Tuple) -> bool:
+        """Add one parsed MCQ unless it duplicates an earlier one"""
+        if is_duplicate_question(parsed[1], self._seen_tokens):
+            return False
+        if co_index is not None and 0 <= co_index < len(self.by_co):
+            self.by_co[co_index].append(parsed)
+        else:
+            self.unattributed.append(parsed)
+        return True
+    
+    def quota(
+        self,
+        targets: List[int],
+        on_mcq: Optional[Callable[[Optional[int], Tuple], None]] = None
+    ) -> StreamQuota:
+        """StreamQuota that only counts MCQs not already in this pool"""
+        return StreamQuota(targets, on_mcq, self._seen_tokens)
+    
+    def add_raw(self, raw_text: str, co_index: Optional[int] = None) -> int:
+        """
+        Parse raw LLM output into the pool
+        Block tags take precedence; co_index is the fallback source CO
+        """
+        added = 0
+        for tag_index, parsed in parse_tagged_mcqs(raw_text):
+            if self.add(tag_index if tag_index is not None else co_index, parsed):
+                added += 1
+        return added
+    
+    def deficits(self, questions_per_co: List[int], missing: int) -> List[int]:
+        """
+        Per-CO number of questions still owed, capped so the total
+        equals the overall number missing
+        """
+        result = []
+        for pool, target in zip(self.by_co, questions_per_co):
+            owed = min(max(0, target - len(pool)), missing)
+            result.append(owed)
+            missing -= owed
+        return result
+    
+    def select(self, questions_per_co: List[int]) -> List[Tuple]:
+        """
+        Take each CO's target from its own pool, then fill any shortfall
+        from the surplus of other COs (in CO order) and unattributed MCQs
+        """
+        selected = []
+        surplus = []
+        for pool, target in zip(self.by_co, questions_per_co):
+            selected.extend(pool[:target])
+            surplus.extend(pool[target:])
+        surplus.extend(self.unattributed)
         
-        # Execute all API calls in parallel
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        shortfall = sum(questions_per_co) - len(selected)
+        if shortfall > 0:
+            selected.extend(surplus[:shortfall])
         
-        # Filter out exceptions and combine results
-        all_raw = ""
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"CO {i+1} generation failed: {result}")
-            elif result:
-                all_raw += result + "\n\n"
+        return selected
+
+
+# ===================================================================
+#            MAP-REDUCE GENERATION (Large Documents)
+# ===================================================================
+
+def use_map_reduce(text: str) -> bool:
+    """Whether the document is too large for retrieval-only prompting"""
+    return (
+        settings.map_reduce_enabled
+        and estimate_tokens(text) > settings.map_reduce_threshold_tokens
+    )
+
+
+async def generate_map_reduce_mcqs(
+    text: str,
+    co_list: List[str],
+    questions_per_co: List[int],
+    on_mcq: Optional[Callable[[Optional[int], Tuple], None]] = None,
+    session: Optional[aiohttp.ClientSession] = None
+) -> Tuple[MCQPool, Dict[str, str]]:
+    """
+    Map: generate MCQs per (section, CO) pair under a concurrency cap
+    Reduce: merge and deduplicate into a per-CO pool (rebalanced by the caller)
+    Returns: (pool, co_contexts) where co_contexts holds each CO's
+    best-ranked section for follow-up single-CO prompts
+    """
+    sections = chunk_text(text, settings.context_token_budget)
+    index = BM25Index(sections)
+    semaphore = asyncio.Semaphore(settings.map_reduce_concurrency)
+    
+    co_contexts = {}
+    jobs = []  # (co_idx, section, count)
+    for co_idx, (co, count) in enumerate(zip(co_list, questions_per_co)):
+        ranked = index.rank(co)
+        co_contexts[co] = sections[ranked[0]] if ranked else text
         
-        return all_raw
+        buffered_count = max(1, round(count * (1 + settings.generation_buffer)))
+        n_sections = max(1, min(settings.map_reduce_max_sections_per_co, buffered_count, len(ranked)))
+        for section_idx, section_count in zip(ranked[:n_sections], _split_count(buffered_count, n_sections)):
+            for batch_count in split_by_output_budget(section_count):
+                jobs.append((co_idx, sections[section_idx], batch_count))
+    
+    logger.info(
+        f"Map-reduce: {len(sections)} sections, {len(jobs)} (section, CO) jobs, "
+        f"concurrency {settings.map_reduce_concurrency}"
+    )
+    
+    quota = StreamQuota(questions_per_co, on_mcq)
+    if session is None:
+        session = http_client.session
+    
+    async def run_job(co_idx: int, section: str, count: int) -> str:
+        async with semaphore:
+            if quota.satisfied([co_idx]):
+                return ""  # Earlier sections already covered this CO
+            return await generate_mcqs_for_co_async(session, section, co_list[co_idx], count, co_idx, quota)
+    
+    results = await asyncio.gather(
+        *(run_job(co_idx, section, count) for co_idx, section, count in jobs),
+        return_exceptions=True
+    )
+    
+    # Reduce: group by source CO and dedupe globally
+    pool = MCQPool(len(co_list))
+    for (co_idx, _, _), result in zip(jobs, results):
+        if isinstance(result, Exception) or not result:
+            continue
+        pool.add_raw(result, co_idx)
+    
+    logger.info(f"Map-reduce: {len(pool)} unique MCQs")
+    return pool, co_contexts
 
 
 # ===================================================================
 #              BALANCED MCQ GENERATION (Main Entry Point)
 # ===================================================================
 
-async def generate_balanced_mcqs(text: str, co_list: List[str], total: int) -> Dict:
+def map_mcqs(
+    parsed_blocks: List[Tuple[str, str, Dict[str, str], str]],
+    mapping_index: COIndex
+) -> List[Dict]:
+    """
+    Attach CO mapping (batched) and Bloom level to parsed MCQs
+    mapping_index is the compiled CO index (co_index always means a CO position)
+    """
+    questions = [parsed[1] for parsed in parsed_blocks]
+    matches = mapping_index.match(questions, settings.co_alternatives_top_k)
+    levels = detect_bloom_levels_batch(questions)
+    mapped = []
+    for (block, question, options, correct), match, level in zip(parsed_blocks, matches, levels):
+        mapped.append({
+            "question_block": block,
+            "question_text": question,
+            "options": options,
+            "correct_answer": correct,
+            **match,
+            "bloom_level": level,
+        })
+    return mapped
+
+
+async def top_up_mcqs(
+    pool: MCQPool,
+    co_list: List[str],
+    questions_per_co: List[int],
+    co_contexts: Dict[str, str],
+    max_cycles: int = 3,
+    on_mcq: Optional[Callable[[Optional[int], Tuple], None]] = None,
+    on_event: Optional[Callable[[str, Dict], None]] = None,
+    session: Optional[aiohttp.ClientSession] = None
+) -> None:
+    """
+    Fill per-CO deficits left after the first pass
+    Each cycle issues one concurrent batch sized to the exact deficit of
+    every CO, over the shared pooled session
+    """
+    total = sum(questions_per_co)
+    if session is None:
+        session = http_client.session
+    
+    for cycle in range(1, max_cycles + 1):
+        missing = total - len(pool)
+        if missing <= 0:
+            return
+        
+        deficits = pool.deficits(questions_per_co, missing)
+        jobs = [
+            (co_idx, batch)
+            for co_idx, owed in enumerate(deficits)
+            if owed > 0
+            for batch in split_by_output_budget(owed)
+        ]
+        logger.info(
+            f"Retry cycle {cycle}: Missing {missing} MCQs, "
+            f"{len(jobs)} concurrent request(s)"
+        )
+        if on_event:
+            on_event("progress", {"stage": "top_up", "cycle": cycle, "missing": missing})
+        
+        quota = pool.quota(deficits, on_mcq)
+        results = await asyncio.gather(*(
+            generate_mcqs_for_co_async(
+                session, co_contexts[co_list[co_idx]], co_list[co_idx], count, co_idx, quota
+            )
+            for co_idx, count in jobs
+        ))
+        for (co_idx, _), raw in zip(jobs, results):
+            pool.add_raw(raw, co_idx)
+
+
+async def generate_balanced_mcqs(
+    text: str,
+    co_list: List[str],
+    total: int,
+    on_event: Optional[Callable[[str, Dict], None]] = None,
+    session: Optional[aiohttp.ClientSession] = None
+) -> Dict:
     """
     Generate balanced MCQs across all COs with exact count
-    Uses parallel API calls for performance
+    Uses parallel API calls for performance over one pooled session
+    (the shared app client unless a session is injected)
+    on_event(kind, payload) receives "mcq" events with each mapped MCQ as
+    soon as it is parsed (provisional, at most `total`) and "progress"
+    events per stage; the returned result is the final selection
     """
     n = len(co_list)
     if n == 0:
         raise ValueError("CO list is empty")
+    if session is None:
+        session = http_client.session
+    _prompt_occurrences.set({})
     
     # Calculate questions per CO
     base = total // n
@@ -382,70 +1158,48 @@ async def generate_balanced_mcqs(text: str, co_list: List[str], total: int) -> D
     
     logger.info(f"Generating {total} MCQs across {n} COs: {questions_per_co}")
     
-    # Generate MCQs in parallel (async)
-    all_raw = await generate_all_mcqs_parallel(text, co_list, questions_per_co)
-    
-    # Parse MCQs
-    parsed_blocks = parse_mcqs(all_raw)
-    logger.info(f"First pass: {len(parsed_blocks)} valid MCQs")
+    # Compiled CO index, shared across requests with the same CO set
+    mapping_index = co_index_registry.get(co_list)
     
-    # Precompute CO keywords for efficient mapping
-    co_keyword_sets = precompute_co_keywords(co_list)
+    # Push each new (non-duplicate) MCQ to the caller as it streams in
+    on_mcq = None
+    if on_event:
+        streamed_tokens: List[set] = []
+        
+        def on_mcq(co_index: Optional[int], parsed: Tuple) -> None:
+            if len(streamed_tokens) >= total or is_duplicate_question(parsed[1], streamed_tokens):
+                return
+            on_event("mcq", map_mcqs([parsed], mapping_index)[0])
     
-    # Map questions to COs
-    mapped_questions = []
-    for block, question, options, correct in parsed_blocks:
-        co_id, co_desc, similarity = map_question_to_co(question, co_keyword_sets, co_list)
-        bloom = detect_bloom_level(question)
+    if use_map_reduce(text):
+        # Document exceeds the context window: fan out over sections
+        pool, co_contexts = await generate_map_reduce_mcqs(
+            text, co_list, questions_per_co, on_mcq, session
+        )
+    else:
+        # Select per-CO reference context once; reused by the retry cycles
+        selector = ContextSelector(text)
+        co_contexts = {co: selector.select(co) for co in co_list}
         
-        mapped_questions.append({
-            "question_block": block,
-            "question_text": question,
-            "options": options,
-            "correct_answer": correct,
-            "mapped_co": co_id,
-            "co_description": co_desc,
-            "similarity_score": similarity,
-            "bloom_level": bloom,
-        })
+        # Generate MCQs in parallel (async); blocks come back CO-tagged
+        all_raw = await generate_all_mcqs_parallel(
+            text, co_list, questions_per_co, selector, StreamQuota(questions_per_co, on_mcq), session
+        )
+        pool = MCQPool(n)
+        pool.add_raw(all_raw)
+    logger.info(f"First pass: {len(pool)} valid MCQs")
+    if on_event:
+        on_event("progress", {"stage": "first_pass", "valid": len(pool), "total": total})
     
-    # Retry logic for missing questions
-    missing = total - len(mapped_questions)
-    retry_cycles = 0
-    max_retry_cycles = 3
+    # Top up per-CO deficits, then keep each CO's share of the exact count
+    await top_up_mcqs(
+        pool, co_list, questions_per_co, co_contexts,
+        on_mcq=on_mcq, on_event=on_event, session=session
+    )
+    parsed_blocks = pool.select(questions_per_co)
     
-    while missing > 0 and retry_cycles < max_retry_cycles:
-        retry_cycles += 1
-        logger.info(f"Retry cycle {retry_cycles}: Missing {missing} MCQs")
-        
-        async with aiohttp.ClientSession() as session:
-            for co in co_list:
-                if missing <= 0:
-                    break
-                
-                # Generate 1 MCQ asynchronously for retry
-                retry_raw = await generate_mcqs_for_co_async(session, text, co, 1)
-                
-                retry_parsed = parse_mcqs(retry_raw)
-                if retry_parsed:
-                    block, question, options, correct = retry_parsed[0]
-                    co_id, co_desc, similarity = map_question_to_co(question, co_keyword_sets, co_list)
-                    bloom = detect_bloom_level(question)
-                    
-                    mapped_questions.append({
-                        "question_block": block,
-                        "question_text": question,
-                        "options": options,
-                        "correct_answer": correct,
-                        "mapped_co": co_id,
-                        "co_description": co_desc,
-                        "similarity_score": similarity,
-                        "bloom_level": bloom,
-                    })
-                    missing -= 1
-    
-    # Trim to exact count
-    mapped_questions = mapped_questions[:total]
+    # Map questions to COs (one batch)
+    mapped_questions = map_mcqs(parsed_blocks, mapping_index)
     
     logger.info(f"Final MCQ count: {len(mapped_questions)}")
     
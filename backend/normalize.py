@@ -0,0 +1,165 @@
+"""
+Normalization of extracted text before it is used in prompts
+- Drops running headers/footers that repeat across PDF pages, including
+  long ones repeated verbatim, and page numbers/separators at page edges
+- For web pages only, drops whole lines of site chrome (cookie banners,
+  nav links)
+- Collapses runs of spaces inside lines (indentation of code is kept) and
+  reports the tokens saved per document
+Lines in the body of a page (code braces, table cells, repeated code or
+table rows) are never dropped
+"""
+import re
+from collections import Counter
+from typing import Any, Dict, List
+
+from config import settings
+from logger import logger
+from retrieval import estimate_tokens
+
+
+# A page number ("12", "- 12 -", "xiv") or a separator ("-----", "* * *");
+# only dropped at page edges, so braces and table cells in the body survive
+_PAGE_NUMBER_RE = re.compile(
+    r"^\W*(?:\d+|(?=[ivx])x{0,3}(?:ix|iv|v?i{0,3}))\W*$|^([-=_*~.•])(?:\s*\1){2,}$", re.I
+)
+_DIGITS_RE = re.compile(r"\d+")
+
+# Website chrome that survives HTML tag stripping; the whole line must be
+# one of these phrases (wrapped prose like "design in Fig. 3" never matches)
+_BOILERPLATE_RE = re.compile(
+    r"(?:(?:accept|allow|reject|manage)(?: all)? cookies|cookies? (?:policy|settings|preferences)|"
+    r"this (?:site|website) uses cookies\b.*|privacy policy|terms (?:of (?:use|service)|and conditions)|"
+    r"(?:©|\(c\)|copyright\b).*\ball rights reserved|all rights reserved|"
+    r"skip to (?:main )?content|subscribe(?: now| to (?:our|the) newsletter)?|newsletter|"
+    r"follow us(?: on \w+)?|share (?:this(?: (?:page|article|post))?|on \w+)|back to top|"
+    r"sign (?:in|up|out)|log ?(?:in|out)|home|menu|search|next|previous|close)\W*",
+    re.I,
+)
+
+# Header/footer candidates are short lines near the top or bottom of a page;
+# long edge lines repeated verbatim on an earlier page's edge are dropped too
+MAX_HEADER_LINE_CHARS = 120
+HEADER_EDGE_LINES = 2
+MIN_DUPLICATE_LINE_CHARS = 30
+
+
+def _signature(line: str) -> str:
+    """Line identity for header detection ('Page 3 of 40' == 'Page 4 of 40')"""
+    return _DIGITS_RE.sub("#", line.strip().lower())
+
+
+def _collapse_spaces(line: str) -> str:
+    """Single spaces between words; leading indentation kept, blank lines emptied"""
+    words = line.split()
+    if not words:
+        return ""
+    return line[:len(line) - len(line.lstrip())] + " ".join(words)
+
+
+def _edge_lines(lines: List[str]) -> List[int]:
+    """Indices of the first and last few non-empty lines of a page"""
+    filled = [i for i, line in enumerate(lines) if line]
+    return filled[:HEADER_EDGE_LINES] + filled[-HEADER_EDGE_LINES:]
+
+
+class TextNormalizer:
+    """Strips boilerplate from extracted documents and tracks the savings"""
+
+    def __init__(self, min_pages: int = 3, page_fraction: float = 0.3):
+        self._min_pages = min_pages
+        self._page_fraction = page_fraction
+        self._documents = 0
+        self._tokens_in = 0
+        self._tokens_out = 0
+        self._lines_dropped = 0
+
+    def normalize(self, pages: List[str], source: str = "document", web: bool = False) -> str:
+        """
+        Normalize a document given as page texts (a single string for
+        unpaginated sources); returns the text with one newline per page
+        Site chrome is only stripped from web pages (web=True)
+        """
+        tokens_in = sum(estimate_tokens(page) for page in pages)
+        pages = [[_collapse_spaces(line) for line in page.split("\n")] for page in pages]
+        repeated = self._repeated_signatures(pages)
+
+        seen_edges = set()  # Long edge lines of earlier pages
+        kept_pages = []
+        dropped = 0
+        for lines in pages:
+            edges = set(_edge_lines(lines)) if len(pages) > 1 else ()
+            page_edges = set()
+            kept = []
+            for i, line in enumerate(lines):
+                if not line:
+                    if kept and kept[-1]:
+                        kept.append(line)  # Keep single paragraph breaks
+                    continue
+                text = line.lstrip()
+                if i in edges:
+                    if len(text) >= MIN_DUPLICATE_LINE_CHARS:
+                        page_edges.add(text)
+                    if (
+                        _PAGE_NUMBER_RE.match(text)
+                        or _signature(text) in repeated
+                        or text in seen_edges
+                    ):
+                        dropped += 1
+                        continue
+                if web and _BOILERPLATE_RE.fullmatch(text):
+                    dropped += 1
+                    continue
+                kept.append(line)
+            seen_edges |= page_edges
+            while kept and not kept[-1]:
+                kept.pop()
+            if kept:
+                kept_pages.append("\n".join(kept))
+
+        text = "".join(page + "\n" for page in kept_pages)
+        self._record(tokens_in, text, dropped, source)
+        return text
+
+    def _repeated_signatures(self, pages: List[List[str]]) -> set:
+        """Short lines present on a large share of pages (running headers/footers)"""
+        if len(pages) < self._min_pages:
+            return set()
+        counts = Counter()
+        for lines in pages:
+            counts.update({
+                _signature(lines[i]) for i in _edge_lines(lines)
+                if len(lines[i]) <= MAX_HEADER_LINE_CHARS
+            })
+        threshold = max(self._min_pages, int(len(pages) * self._page_fraction + 0.5))
+        return {sig for sig, n in counts.items() if n >= threshold}
+
+    def _record(self, tokens_in: int, text: str, dropped: int, source: str) -> None:
+        tokens_out = estimate_tokens(text)
+        self._documents += 1
+        self._tokens_in += tokens_in
+        self._tokens_out += tokens_out
+        self._lines_dropped += dropped
+        saved = tokens_in - tokens_out
+        logger.info(
+            f"Normalized {source}: {tokens_in} -> {tokens_out} tokens "
+            f"(saved {saved}, {dropped} lines dropped)"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        saved = self._tokens_in - self._tokens_out
+        return {
+            "documents": self._documents,
+            "tokens_in": self._tokens_in,
+            "tokens_out": self._tokens_out,
+            "tokens_saved": saved,
+            "saved_ratio": round(saved / self._tokens_in, 3) if self._tokens_in else 0.0,
+            "lines_dropped": self._lines_dropped,
+        }
+
+
+# Global normalizer instance
+text_normalizer = TextNormalizer(
+    min_pages=settings.boilerplate_min_pages,
+    page_fraction=settings.boilerplate_page_fraction,
+)
@@ -1,64 +1,57 @@
 """
-Simple in-memory rate limiter
+Simple rate limiter
 Prevents API quota exhaustion
+- GCRA over minute and hour windows: one timestamp per window per client,
+  monotonic clock, idle clients evicted
+- State kept in the shared state backend, so limits hold across worker
+  processes when STATE_BACKEND=sqlite
 """
-from collections import deque
-from datetime import datetime, timedelta
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
+
+from config import settings
+from state import state_backend
 
 
 class RateLimiter:
-    """Token bucket rate limiter with per-IP tracking"""
+    """GCRA rate limiter keyed by client (API token or IP)"""
     
-    def __init__(self, requests_per_minute: int = 5, requests_per_hour: int = 100):
+    def __init__(self, backend, requests_per_minute: int = 5, requests_per_hour: int = 100):
+        self._backend = backend
         self._rpm = requests_per_minute
         self._rph = requests_per_hour
-        self._minute_buckets = {}  # ip -> deque of timestamps
-        self._hour_buckets = {}
-    
-    def _clean_old_entries(self, bucket: deque, window: timedelta) -> None:
-        """Remove timestamps outside the time window"""
-        cutoff = datetime.now() - window
-        while bucket and bucket[0] < cutoff:
-            bucket.popleft()
+        self._windows = [(60.0, requests_per_minute), (3600.0, requests_per_hour)]
+        self._allowed = 0
+        self._blocked = 0
     
-    def is_allowed(self, client_ip: str) -> tuple[bool, Optional[str]]:
+    def is_allowed(self, client_key: str) -> tuple[bool, Optional[str]]:
         """
-        Check if request is allowed for this IP
+        Check if request is allowed for this client
         Returns: (allowed: bool, error_message: Optional[str])
         """
-        now = datetime.now()
-        
-        # Initialize buckets for new IPs
-        if client_ip not in self._minute_buckets:
-            self._minute_buckets[client_ip] = deque()
-            self._hour_buckets[client_ip] = deque()
-        
-        minute_bucket = self._minute_buckets[client_ip]
-        hour_bucket = self._hour_buckets[client_ip]
+        blocked = self._backend.rate_record(client_key, time.monotonic(), self._windows)
         
-        # Clean old entries
-        self._clean_old_entries(minute_bucket, timedelta(minutes=1))
-        self._clean_old_entries(hour_bucket, timedelta(hours=1))
+        if blocked is None:
+            self._allowed += 1
+            return True, None
         
-        # Check limits
-        if len(minute_bucket) >= self._rpm:
+        self._blocked += 1
+        if blocked == 0:
             return False, f"Rate limit exceeded: {self._rpm} requests per minute"
-        
-        if len(hour_bucket) >= self._rph:
-            return False, f"Rate limit exceeded: {self._rph} requests per hour"
-        
-        # Add current request
-        minute_bucket.append(now)
-        hour_bucket.append(now)
-        
-        return True, None
+        return False, f"Rate limit exceeded: {self._rph} requests per hour"
+    
+    def reset(self, client_key: str) -> None:
+        """Reset rate limit for specific client"""
+        self._backend.rate_reset(client_key)
     
-    def reset(self, client_ip: str) -> None:
-        """Reset rate limit for specific IP"""
-        self._minute_buckets.pop(client_ip, None)
-        self._hour_buckets.pop(client_ip, None)
+    def stats(self) -> Dict[str, Any]:
+        """Tracked clients, idle evictions and decisions (this process)"""
+        return {**self._backend.rate_stats(), "allowed": self._allowed, "blocked": self._blocked}
 
 
 # Global rate limiter instance
-rate_limiter = RateLimiter(requests_per_minute=5, requests_per_hour=100)
+rate_limiter = RateLimiter(
+    state_backend,
+    requests_per_minute=settings.rate_limit_requests_per_minute,
+    requests_per_hour=settings.rate_limit_requests_per_hour,
+)
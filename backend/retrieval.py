@@ -0,0 +1,183 @@
+"""
+Retrieval-based context selection for MCQ prompts
+- Paragraph chunking bounded by an approximate token size
+- BM25 ranking of chunks against each CO description
+- Per-query context selection that fits a configurable token budget
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+from config import settings
+from logger import logger
+
+
+# Rough heuristic for Llama-family tokenizers: ~4 characters per token
+CHARS_PER_TOKEN = 4
+
+_TERM_RE = re.compile(r"\b[a-z0-9]+\b")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of LLM tokens in a piece of text"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _terms(text: str) -> List[str]:
+    """Extract lowercase terms used for ranking"""
+    return _TERM_RE.findall(text.lower())
+
+
+# ===================================================================
+#                            CHUNKING
+# ===================================================================
+
+def _split_oversized(unit: str, max_tokens: int) -> List[str]:
+    """Split a paragraph that exceeds the chunk size into lines or word runs"""
+    pieces = []
+    for line in unit.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if estimate_tokens(line) <= max_tokens:
+            pieces.append(line)
+            continue
+        # A single very long line (e.g. extracted without newlines)
+        words = line.split()
+        step = max(1, (max_tokens * CHARS_PER_TOKEN) // 6)
+        for i in range(0, len(words), step):
+            pieces.append(" ".join(words[i:i + step]))
+    return pieces
+
+
+def chunk_text(text: str, max_chunk_tokens: int) -> List[str]:
+    """
+    Split text into paragraph chunks of at most ~max_chunk_tokens each
+    Small consecutive paragraphs are packed together to keep chunk count low
+    """
+    units = []
+    for para in _PARAGRAPH_RE.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        if estimate_tokens(para) <= max_chunk_tokens:
+            units.append(para)
+        else:
+            units.extend(_split_oversized(para, max_chunk_tokens))
+
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    for unit in units:
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_chunk_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        chunks.append("\n".join(current))
+
+    return chunks
+
+
+# ===================================================================
+#                          BM25 RANKING
+# ===================================================================
+
+class BM25Index:
+    """Okapi BM25 index over document chunks, built once per document"""
+
+    def __init__(self, chunks: List[str], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self._k1 = k1
+        self._b = b
+        self._term_freqs = [Counter(_terms(c)) for c in chunks]
+        self._lengths = [sum(tf.values()) for tf in self._term_freqs]
+        self._avg_len = (sum(self._lengths) / len(chunks)) if chunks else 0.0
+        self._chunk_tokens = [estimate_tokens(c) for c in chunks]
+
+        doc_freq: Counter = Counter()
+        for tf in self._term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(chunks)
+        self._idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """BM25 score of every chunk for the given query"""
+        query_terms = [t for t in set(_terms(query)) if t in self._idf]
+        results = []
+        for tf, length in zip(self._term_freqs, self._lengths):
+            norm = self._k1 * (1 - self._b + self._b * length / (self._avg_len or 1))
+            score = 0.0
+            for term in query_terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self._idf[term] * freq * (self._k1 + 1) / (freq + norm)
+            results.append(score)
+        return results
+
+    def rank(self, query: str) -> List[int]:
+        """Chunk indices ordered by descending score (ties keep document order)"""
+        scores = self.scores(query)
+        return sorted(range(len(self.chunks)), key=lambda i: (-scores[i], i))
+
+    def select(self, query: str, token_budget: int) -> str:
+        """
+        Return the best-ranked chunks that fit within token_budget
+        Chunks are re-joined in original document order to keep the text readable
+        """
+        chosen = []
+        remaining = token_budget
+        for idx in self.rank(query):
+            if remaining <= 0:
+                break
+            if self._chunk_tokens[idx] <= remaining:
+                chosen.append(idx)
+                remaining -= self._chunk_tokens[idx]
+
+        chosen.sort()
+        return "\n\n".join(self.chunks[i] for i in chosen)
+
+
+# ===================================================================
+#                     PER-CO CONTEXT SELECTION
+# ===================================================================
+
+class ContextSelector:
+    """
+    Selects budget-bounded reference context for arbitrary queries
+    The BM25 index is built lazily, once per document, and only when the
+    document does not already fit the budget
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.budget = settings.context_token_budget
+        self.doc_tokens = estimate_tokens(text)
+        self._index: Optional[BM25Index] = None
+        self._selected: Dict[str, str] = {}
+
+    @property
+    def passthrough(self) -> bool:
+        """True when the whole document is sent as-is"""
+        return not settings.retrieval_enabled or self.doc_tokens <= self.budget
+
+    def select(self, query: str) -> str:
+        """Context for a single query (a CO description or a group of them)"""
+        if self.passthrough:
+            return self.text
+        if query not in self._selected:
+            if self._index is None:
+                self._index = BM25Index(chunk_text(self.text, settings.retrieval_chunk_tokens))
+                logger.info(
+                    f"Retrieval: {len(self._index.chunks)} chunks, ~{self.doc_tokens} doc tokens, "
+                    f"budget {self.budget} tokens per prompt"
+                )
+            self._selected[query] = self._index.select(query, self.budget)
+        return self._selected[query]
@@ -0,0 +1,240 @@
+"""
+Process-wide scheduler for upstream (Groq) API calls
+- Request/token budgets kept in sync with x-ratelimit-* response headers
+- AIMD concurrency: additive increase on success, halve on 429
+- Round-robin queueing across clients so one large request cannot starve others
+"""
+import asyncio
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Deque, Dict, Mapping, Optional
+
+from config import settings
+from logger import logger
+
+
+# Client on whose behalf upstream calls are made (set per generation by the app)
+upstream_client: ContextVar[str] = ContextVar("upstream_client", default="anonymous")
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Halve concurrency at most once per this many seconds (a burst of 429s from
+# calls that were already in flight is one congestion signal, not many)
+DECREASE_COOLDOWN_SECONDS = 1.0
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse Groq reset durations such as '7.66s', '2m59.56s' or '120ms'"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+class _Budget:
+    """Remaining upstream allowance (requests or tokens) until the next reset"""
+
+    def __init__(self, limit: int, window_seconds: float = 60.0):
+        self.limit = limit
+        self.remaining = limit
+        self.window = window_seconds
+        self.reset_at = 0.0
+
+    def available(self, now: float) -> int:
+        if now >= self.reset_at:
+            return self.limit
+        return self.remaining
+
+    def reserve(self, amount: int, now: float) -> None:
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.window
+        self.remaining -= amount
+
+    def observe(self, limit: Optional[str], remaining: Optional[str], reset: Optional[str],
+                in_flight: int, now: float) -> None:
+        """Adopt the server's view, minus what is still reserved in flight"""
+        if limit and limit.isdigit():
+            self.limit = int(limit)
+        if remaining and remaining.isdigit():
+            self.remaining = int(remaining) - in_flight
+            seconds = parse_duration(reset)
+            self.reset_at = now + (seconds if seconds is not None else self.window)
+
+    def wait_time(self, amount: int, now: float) -> float:
+        """Seconds until amount fits (0 when it fits now)"""
+        return 0.0 if self.available(now) >= amount else max(0.0, self.reset_at - now)
+
+
+class _Slot:
+    """One admitted upstream call; record the response via observe()"""
+
+    def __init__(self, client: str, tokens: int):
+        self.client = client
+        self.tokens = tokens
+        self.status: Optional[int] = None
+        self.headers: Mapping[str, str] = {}
+
+    def observe(self, status: int, headers: Mapping[str, str]) -> None:
+        self.status = status
+        self.headers = headers
+
+
+class UpstreamScheduler:
+    """Admission control in front of every Groq call"""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int,
+                 initial_concurrency: int, max_concurrency: int):
+        self._requests = _Budget(requests_per_minute)
+        self._tokens = _Budget(tokens_per_minute)
+        self._limit = float(max(1, initial_concurrency))
+        self._max_limit = max(1, max_concurrency)
+        self._in_flight = 0
+        self._reserved_tokens = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._waiting: "OrderedDict[str, Deque]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._admitted = 0
+        self._throttled = 0
+
+    @property
+    def concurrency_limit(self) -> int:
+        return int(self._limit)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int) -> AsyncIterator[_Slot]:
+        """Wait for capacity, then hold one upstream slot for the block"""
+        slot = await self._acquire(upstream_client.get(), tokens)
+        try:
+            yield slot
+        finally:
+            self._release(slot)
+
+    async def _acquire(self, client: str, tokens: int) -> _Slot:
+        # A single call larger than the whole budget must still be admissible
+        slot = _Slot(client, min(tokens, self._tokens.limit))
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(client, deque()).append((slot, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(slot)
+            else:
+                self._forget(client, future)
+            raise
+        return slot
+
+    def _forget(self, client: str, future: asyncio.Future) -> None:
+        queue = self._waiting.get(client)
+        if queue is None:
+            return
+        for entry in list(queue):
+            if entry[1] is future:
+                queue.remove(entry)
+        if not queue:
+            del self._waiting[client]
+
+    def _dispatch(self) -> None:
+        """Admit waiting calls round-robin across clients while capacity allows"""
+        now = time.monotonic()
+        while self._waiting and self._in_flight < int(self._limit):
+            client, queue = next(iter(self._waiting.items()))
+            slot, future = queue[0]
+            if future.done():
+                queue.popleft()
+                if not queue:
+                    del self._waiting[client]
+                continue
+
+            wait = max(
+                self._paused_until - now,
+                self._requests.wait_time(1, now),
+                self._tokens.wait_time(slot.tokens, now),
+            )
+            if wait > 0:
+                self._schedule(wait)
+                return
+
+            queue.popleft()
+            # Rotate: this client goes to the back of the line
+            del self._waiting[client]
+            if queue:
+                self._waiting[client] = queue
+
+            self._requests.reserve(1, now)
+            self._tokens.reserve(slot.tokens, now)
+            self._reserved_tokens += slot.tokens
+            self._in_flight += 1
+            self._admitted += 1
+            future.set_result(None)
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _release(self, slot: _Slot) -> None:
+        self._in_flight -= 1
+        self._reserved_tokens -= slot.tokens
+        now = time.monotonic()
+
+        if slot.headers:
+            h = slot.headers
+            self._requests.observe(
+                h.get("x-ratelimit-limit-requests"), h.get("x-ratelimit-remaining-requests"),
+                h.get("x-ratelimit-reset-requests"), self._in_flight, now
+            )
+            self._tokens.observe(
+                h.get("x-ratelimit-limit-tokens"), h.get("x-ratelimit-remaining-tokens"),
+                h.get("x-ratelimit-reset-tokens"), self._reserved_tokens, now
+            )
+
+        if slot.status == 429:
+            self._throttled += 1
+            retry_after = parse_duration(slot.headers.get("retry-after")) or settings.rate_limit_delay_seconds
+            self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease >= DECREASE_COOLDOWN_SECONDS:
+                self._limit = max(1.0, self._limit / 2)
+                self._last_decrease = now
+                logger.warning(
+                    f"Upstream 429: concurrency -> {int(self._limit)}, pausing {retry_after:.1f}s"
+                )
+        elif slot.status is not None and slot.status < 400:
+            self._limit = min(float(self._max_limit), self._limit + 1 / self._limit)
+
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "concurrency_limit": int(self._limit),
+            "in_flight": self._in_flight,
+            "queued": {client: len(q) for client, q in self._waiting.items()},
+            "requests_remaining": self._requests.available(now),
+            "tokens_remaining": self._tokens.available(now),
+            "paused_for_seconds": round(max(0.0, self._paused_until - now), 2),
+            "admitted": self._admitted,
+            "throttled": self._throttled,
+        }
+
+
+# Global scheduler instance
+upstream_scheduler = UpstreamScheduler(
+    requests_per_minute=settings.groq_requests_per_minute,
+    tokens_per_minute=settings.groq_tokens_per_minute,
+    initial_concurrency=settings.upstream_initial_concurrency,
+    max_concurrency=settings.upstream_max_concurrency,
+)
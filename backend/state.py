@@ -0,0 +1,347 @@
+"""
+Pluggable state backends for the MCQ cache and the request rate limiter
+- LocalStateBackend: in-process dicts (single worker)
+- SQLiteStateBackend: one SQLite file in WAL mode shared by every worker on
+  the host, so `uvicorn --workers N` keeps one cache and correct limits
+Cache timestamps are wall-clock (time.time()); rate-limit timestamps come
+from time.monotonic(), which is system-wide on a host
+SQLite calls run on the event loop, so lock waits are capped at
+STATE_BUSY_TIMEOUT_MS and a call still locked out after that fails open
+(cache miss / request admitted) instead of stalling every request
+"""
+import functools
+import json
+import os
+import sqlite3
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import settings
+from logger import logger
+
+
+# (window_seconds, max_requests) pairs checked by the rate limiter
+RateWindows = List[Tuple[float, int]]
+
+# Full scan for idle rate-limit keys at most this often
+RATE_SWEEP_INTERVAL_SECONDS = 60.0
+
+
+def gcra_update(tats: List[float], now: float, windows: RateWindows) -> Optional[int]:
+    """
+    Generic cell rate algorithm over several windows at once
+    tats holds one theoretical arrival time per window and is updated in
+    place only when every window admits the request. Returns the index of
+    the first window that rejects it, or None when admitted.
+    """
+    updated = []
+    for i, ((period, limit), tat) in enumerate(zip(windows, tats)):
+        interval = period / limit
+        if tat > now + period:
+            tat = now  # Impossible under GCRA: stale state from a restarted clock
+        tat = max(tat, now)
+        if tat - now > period - interval:
+            return i
+        updated.append(tat + interval)
+    tats[:] = updated
+    return None
+
+
+def _fail_open(default: Any):
+    """Return default when the database stays locked past busy_timeout"""
+    def wrap(method):
+        @functools.wraps(method)
+        def run(self, *args):
+            try:
+                return method(self, *args)
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                self._busy += 1
+                logger.warning(f"State backend busy, {method.__name__} skipped: {e}")
+                return default
+        return run
+    return wrap
+
+
+class LocalStateBackend:
+    """Process-local state (the original in-memory behaviour)"""
+
+    def __init__(self, max_rate_keys: int = 100_000):
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()  # key -> (data, expires, bytes)
+        self._bytes = 0
+        self._counters: Counter = Counter()
+        self._rate: "OrderedDict[str, List[float]]" = OrderedDict()  # key -> TAT per window
+        self._max_rate_keys = max_rate_keys
+        self._next_rate_sweep = 0.0
+
+    # ---------------- cache ----------------
+
+    def cache_get(self, key: str, now: float) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        data, expires, _ = entry
+        if now >= expires:
+            self._drop(key)
+            self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return data
+
+    def cache_set(self, key: str, data: Any, size: int, now: float, expires: float,
+                  max_entries: int, max_bytes: int) -> None:
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (data, expires, size)
+        self._bytes += size
+        while len(self._entries) > max_entries or self._bytes > max_bytes:
+            self._drop(next(iter(self._entries)))
+            self._counters["evictions"] += 1
+
+    def _drop(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def cache_sweep(self, now: float) -> int:
+        expired = [key for key, (_, expires, _) in self._entries.items() if now >= expires]
+        for key in expired:
+            self._drop(key)
+        self._counters["expirations"] += len(expired)
+        return len(expired)
+
+    def cache_clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def cache_stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            **{name: self._counters[name] for name in ("hits", "misses", "evictions", "expirations")},
+        }
+
+    # ------------- rate limiting -------------
+
+    def rate_record(self, key: str, now: float, windows: RateWindows) -> Optional[int]:
+        """
+        Admit one request for key (GCRA, constant state per key)
+        Returns the index of the first window that rejects it, or None
+        """
+        tats = self._rate.pop(key, None) or [now] * len(windows)
+        blocked = gcra_update(tats, now, windows)
+        self._rate[key] = tats  # Most recently used keys live at the end
+        self._evict_rate_keys(now)
+        return blocked
+
+    def _evict_rate_keys(self, now: float) -> None:
+        """Drop idle keys (all TATs in the past) and enforce the key cap"""
+        if now >= self._next_rate_sweep:
+            idle = [key for key, tats in self._rate.items() if max(tats) <= now]
+            for key in idle:
+                del self._rate[key]
+            self._counters["rate_evictions"] += len(idle)
+            self._next_rate_sweep = now + RATE_SWEEP_INTERVAL_SECONDS
+        while self._rate:
+            key, tats = next(iter(self._rate.items()))
+            if max(tats) > now and len(self._rate) <= self._max_rate_keys:
+                break
+            del self._rate[key]
+            self._counters["rate_evictions"] += 1
+
+    def rate_reset(self, key: str) -> None:
+        self._rate.pop(key, None)
+
+    def rate_stats(self) -> Dict[str, int]:
+        return {"keys": len(self._rate), "evictions": self._counters["rate_evictions"]}
+
+
+class SQLiteStateBackend:
+    """State shared across worker processes through a WAL-mode SQLite file"""
+
+    def __init__(self, db_path: str, max_rate_keys: int = 100_000):
+        self._max_rate_keys = max_rate_keys
+        self._next_rate_sweep = 0.0
+        self._busy = 0  # Calls skipped on lock contention (this process)
+        # Autocommit; multi-statement updates take BEGIN IMMEDIATE explicitly
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={settings.state_busy_timeout_ms}")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                expires REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache_entries (last_used);
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            DROP TABLE IF EXISTS rate_events;
+            CREATE TABLE IF NOT EXISTS rate_state (
+                key TEXT PRIMARY KEY,
+                tats TEXT NOT NULL,
+                idle_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_rate_state_idle ON rate_state (idle_at);
+        """)
+        logger.info(f"Shared state backend: {db_path}")
+
+    def _incr(self, name: str, amount: int = 1) -> None:
+        if amount:
+            self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, amount)
+            )
+
+    def _transaction(self):
+        return _Transaction(self._conn)
+
+    # ---------------- cache ----------------
+
+    @_fail_open(None)
+    def cache_get(self, key: str, now: float) -> Optional[Any]:
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT data, expires FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._incr("misses")
+                return None
+            if now >= row[1]:
+                self._conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                self._incr("expirations")
+                self._incr("misses")
+                return None
+            self._conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (now, key))
+            self._incr("hits")
+        return json.loads(row[0])
+
+    @_fail_open(None)
+    def cache_set(self, key: str, data: Any, size: int, now: float, expires: float,
+                  max_entries: int, max_bytes: int) -> None:
+        payload = json.dumps(data, default=str)
+        with self._transaction():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, data, bytes, expires, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, payload, size, expires, now)
+            )
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM cache_entries"
+            ).fetchone()
+            victims = []
+            if entries > max_entries or total > max_bytes:
+                for victim, victim_bytes in self._conn.execute(
+                    "SELECT key, bytes FROM cache_entries ORDER BY last_used"
+                ):
+                    if entries <= max_entries and total <= max_bytes:
+                        break
+                    victims.append((victim,))
+                    entries -= 1
+                    total -= victim_bytes
+                self._conn.executemany("DELETE FROM cache_entries WHERE key = ?", victims)
+            self._incr("evictions", len(victims))
+
+    @_fail_open(0)
+    def cache_sweep(self, now: float) -> int:
+        with self._transaction():
+            removed = self._conn.execute(
+                "DELETE FROM cache_entries WHERE expires <= ?", (now,)
+            ).rowcount
+            self._incr("expirations", removed)
+        return removed
+
+    @_fail_open(None)
+    def cache_clear(self) -> None:
+        self._conn.execute("DELETE FROM cache_entries")
+
+    def cache_stats(self) -> Dict[str, int]:
+        entries, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM cache_entries"
+        ).fetchone()
+        counters = dict(self._conn.execute("SELECT name, value FROM counters"))
+        return {
+            "entries": entries,
+            "bytes": total,
+            **{name: counters.get(name, 0) for name in ("hits", "misses", "evictions", "expirations")},
+            "busy": self._busy,
+        }
+
+    # ------------- rate limiting -------------
+
+    @_fail_open(None)
+    def rate_record(self, key: str, now: float, windows: RateWindows) -> Optional[int]:
+        """Same contract as LocalStateBackend.rate_record, atomic across processes"""
+        with self._transaction():
+            row = self._conn.execute("SELECT tats FROM rate_state WHERE key = ?", (key,)).fetchone()
+            tats = json.loads(row[0]) if row else [now] * len(windows)
+            if len(tats) != len(windows):
+                tats = [now] * len(windows)
+            blocked = gcra_update(tats, now, windows)
+            if blocked is None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_state (key, tats, idle_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(tats), max(tats))
+                )
+            if now >= self._next_rate_sweep:
+                self._sweep_rate_keys(now)
+        return blocked
+
+    def _sweep_rate_keys(self, now: float) -> None:
+        """Drop idle keys (all TATs in the past) and enforce the key cap"""
+        removed = self._conn.execute("DELETE FROM rate_state WHERE idle_at <= ?", (now,)).rowcount
+        removed += self._conn.execute(
+            "DELETE FROM rate_state WHERE key IN ("
+            "SELECT key FROM rate_state ORDER BY idle_at "
+            "LIMIT MAX(0, (SELECT COUNT(*) FROM rate_state) - ?))",
+            (self._max_rate_keys,)
+        ).rowcount
+        self._incr("rate_evictions", removed)
+        self._next_rate_sweep = now + RATE_SWEEP_INTERVAL_SECONDS
+
+    @_fail_open(None)
+    def rate_reset(self, key: str) -> None:
+        self._conn.execute("DELETE FROM rate_state WHERE key = ?", (key,))
+
+    def rate_stats(self) -> Dict[str, int]:
+        keys = self._conn.execute("SELECT COUNT(*) FROM rate_state").fetchone()[0]
+        row = self._conn.execute("SELECT value FROM counters WHERE name = 'rate_evictions'").fetchone()
+        return {"keys": keys, "evictions": row[0] if row else 0, "busy": self._busy}
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def create_state_backend():
+    """Backend selected by STATE_BACKEND (local | sqlite)"""
+    if settings.state_backend == "sqlite":
+        path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), settings.state_db_path)
+        return SQLiteStateBackend(path, settings.rate_limit_max_keys)
+    if settings.state_backend != "local":
+        raise ValueError(f"Unknown STATE_BACKEND: {settings.state_backend}")
+    return LocalStateBackend(settings.rate_limit_max_keys)
+
+
+# Global backend shared by mcq_cache and rate_limiter
+state_backend = create_state_backend()
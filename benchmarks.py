@@ -0,0 +1,389 @@
+"""
+Microbenchmarks for AI MCQ Generator hot paths
+Runs in-process against the backend modules (no server or Groq key needed)
+Usage: python benchmarks.py [name ...]
+"""
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("GROQ_API_KEY", "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+
+def print_bench(name: str):
+    """Print benchmark header"""
+    print(f"\n{'='*60}")
+    print(f"BENCHMARK: {name}")
+    print('='*60)
+
+
+def report(label: str, ops: int, elapsed: float, unit: str = "ops"):
+    """Print throughput for one measurement"""
+    print(f"{label:<44} {ops / elapsed:>12,.0f} {unit}/s")
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (Linux; 0 elsewhere)"""
+    # ru_maxrss would include the spawning parent's peak, VmHWM does not
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _in_fresh_process(imports, fn, *args):
+    """
+    Run fn(*args) in a new interpreter after importing the given modules
+    Returns (result, seconds, peak RSS growth in MB)
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_measure, (imports, fn, args))
+
+
+def _measure(imports, fn, args):
+    import importlib
+    for name in imports:
+        importlib.import_module(name)
+    base = _peak_rss_mb()
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start, _peak_rss_mb() - base
+
+
+def bench_rate_limiter():
+    """Rate limiter decisions per second (GCRA)"""
+    from rate_limiter import RateLimiter
+    from state import LocalStateBackend, SQLiteStateBackend
+
+    print_bench("Rate Limiter Decisions")
+    n = 200_000
+
+    limiter = RateLimiter(LocalStateBackend(), requests_per_minute=5, requests_per_hour=100)
+    start = time.perf_counter()
+    for _ in range(n):
+        limiter.is_allowed("ip:10.0.0.1")
+    report("local, 1 hot key", n, time.perf_counter() - start, "decisions")
+
+    keys = [f"ip:10.{i // 65536}.{(i // 256) % 256}.{i % 256}" for i in range(50_000)]
+    limiter = RateLimiter(LocalStateBackend(), requests_per_minute=5, requests_per_hour=100)
+    start = time.perf_counter()
+    for i in range(n):
+        limiter.is_allowed(keys[i % len(keys)])
+    report("local, 50k distinct keys", n, time.perf_counter() - start, "decisions")
+    print(f"{'tracked keys (constant state per key)':<44} {limiter.stats()['keys']:>12,}")
+
+    n_sqlite = 5_000
+    with tempfile.TemporaryDirectory() as tmp:
+        limiter = RateLimiter(SQLiteStateBackend(os.path.join(tmp, "state.db")), 5, 100)
+        start = time.perf_counter()
+        for i in range(n_sqlite):
+            limiter.is_allowed(keys[i % 1000])
+        report("sqlite (shared across workers), 1k keys", n_sqlite, time.perf_counter() - start, "decisions")
+
+
+def _python_docx_text(path: str) -> int:
+    import docx
+    return len("\n".join(p.text for p in docx.Document(path).paragraphs))
+
+
+def _streaming_docx_text(path: str) -> int:
+    from extraction import extract_text
+    return len(extract_text(path))
+
+
+def bench_docx_extraction():
+    """python-docx object model vs streaming word/document.xml reader"""
+    import docx
+
+    print_bench("DOCX Extraction (fresh process per run)")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "syllabus.docx")
+        doc = docx.Document()
+        for unit in range(40):
+            doc.add_heading(f"Unit {unit + 1}", level=1)
+            for i in range(300):
+                doc.add_paragraph(f"Topic {unit}.{i}: stacks, queues, trees and graph traversal notes. " * 3)
+            table = doc.add_table(rows=20, cols=4)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = "CO mapping / hours / outcome"
+        doc.save(path)
+        print(f"{'document':<44} {os.path.getsize(path) / 1024:>10,.0f} KB")
+
+        for label, fn in (("python-docx (paragraphs only)", _python_docx_text),
+                          ("streaming iterparse (paragraphs + tables)", _streaming_docx_text)):
+            chars, elapsed, rss = _in_fresh_process(("docx", "extraction"), fn, path)
+            print(f"{label:<44} {elapsed:>8.2f} s {rss:>8.1f} MB peak RSS growth {chars:>10,} chars")
+
+
+def _synthetic_questions(n: int, seed: int = 7):
+    """Deterministic question-like strings and 20 COs over a shared vocabulary"""
+    import random
+    rng = random.Random(seed)
+    words = ["stack", "queue", "tree", "graph", "hash", "sort", "search", "heap", "list",
+             "array", "pointer", "node", "edge", "path", "cycle", "binary", "balanced",
+             "traversal", "recursion", "complexity", "memory", "index", "key", "value"]
+    verbs = ["explain", "apply", "analyze", "compare", "design", "evaluate", "define", "use"]
+    cos = [
+        f"CO{i + 1}: {rng.choice(verbs).title()} " + " ".join(rng.sample(words, 6))
+        for i in range(20)
+    ]
+    questions = [
+        f"Which {' '.join(rng.sample(words, rng.randint(4, 9)))} best {rng.choice(verbs)}s the result?"
+        for _ in range(n)
+    ]
+    return questions, cos
+
+
+def bench_co_mapping():
+    """Per-question Jaccard loop vs vectorized COIndex, 20 COs"""
+    from co_mapping import COIndex
+    from mcq_core import map_question_to_co, precompute_co_keywords
+
+    print_bench("CO Mapping (20 COs)")
+    for n in (1_000, 10_000, 100_000):
+        questions, cos = _synthetic_questions(n)
+
+        start = time.perf_counter()
+        keyword_sets = precompute_co_keywords(cos)
+        loop = [map_question_to_co(q, keyword_sets, cos) for q in questions]
+        report(f"loop, {n:,} questions", n, time.perf_counter() - start, "questions")
+
+        start = time.perf_counter()
+        batch = COIndex(cos).match(questions, top_k=2)
+        report(f"batch (top-3), {n:,} questions", n, time.perf_counter() - start, "questions")
+
+        agree = sum(
+            (co_id, score) == (m["mapped_co"], m["similarity_score"])
+            for (co_id, _, score), m in zip(loop, batch)
+        )
+        print(f"{'agreement with loop':<44} {agree / n:>12.2%}")
+
+
+def bench_co_scoring():
+    """
+    Jaccard vs TF-IDF mapping: accuracy and throughput on synthetic labelled
+    questions, then agreement with the recorded data/mapped_questions.json
+    """
+    import random
+    from co_mapping import COIndex, WeightedCOIndex
+    from mcq_core import map_question_to_co, precompute_co_keywords
+
+    print_bench("CO Scoring Quality (synthetic: 8 COs, shared CO wording)")
+    rng = random.Random(11)
+    topics = [
+        ["stack", "push", "pop", "postfix"], ["queue", "enqueue", "dequeue", "circular"],
+        ["tree", "binary", "traversal", "inorder"], ["graph", "vertex", "edge", "shortest path"],
+        ["hashing", "collision", "probing", "hash table"], ["sorting", "merge", "quick", "pivot"],
+        ["recursion", "base case", "recursive", "call stack"], ["heap", "priority", "heapify", "min heap"],
+    ]
+    cos = [
+        f"Apply the concepts of {t[0]}, {t[1]} and {t[2]} techniques to solve real time "
+        f"problems using the data structures and algorithms."
+        for t in topics
+    ]
+    templates = [
+        "What is the main purpose of {a} in data structures?",
+        "Which of the following best describes {a} when using {b}?",
+        "In a program, how does {a} differ from {b}?",
+        "What happens during {a} operations in the given algorithm?",
+    ]
+    questions, labels = [], []
+    for _ in range(5_000):
+        label = rng.randrange(len(topics))
+        a, b = rng.sample(topics[label], 2)
+        questions.append(rng.choice(templates).format(a=a, b=b))
+        labels.append(f"CO{label + 1}")
+
+    keyword_sets = precompute_co_keywords(cos)
+    start = time.perf_counter()
+    loop = [map_question_to_co(q, keyword_sets, cos)[0] for q in questions]
+    elapsed = time.perf_counter() - start
+    print(f"{'jaccard loop (current) accuracy':<44} {sum(p == l for p, l in zip(loop, labels)) / len(labels):>12.1%}")
+    report("jaccard loop (current)", len(questions), elapsed, "questions")
+
+    for name, index_cls in (("jaccard batch", COIndex), ("tfidf batch", WeightedCOIndex)):
+        start = time.perf_counter()
+        matches = index_cls(cos).match(questions)
+        elapsed = time.perf_counter() - start
+        accuracy = sum(m["mapped_co"] == l for m, l in zip(matches, labels)) / len(labels)
+        print(f"{name + ' accuracy':<44} {accuracy:>12.1%}")
+        report(name, len(questions), elapsed, "questions")
+
+    # Recorded output of the original mapper: its labels are Jaccard picks
+    # over the full CO list (only the COs it used are in the file), so this
+    # measures agreement with real questions rather than ground truth
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    with open(os.path.join(data_dir, "mapped_questions.json"), encoding="utf-8") as f:
+        recorded = json.load(f)
+    by_id = {m["mapped_to"]: m["description"] for m in recorded}
+    cos = [by_id[co_id] for co_id in sorted(by_id, key=lambda c: int(c[2:]))]
+    questions = [m["question"] for m in recorded]
+    print(f"\nRecorded mappings ({len(recorded)} questions, {len(cos)} COs)")
+    for name, index_cls in (("jaccard batch", COIndex), ("tfidf batch", WeightedCOIndex)):
+        matches = index_cls(cos).match(questions)
+        agree = sum(m["co_description"] == r["description"] for m, r in zip(matches, recorded))
+        print(f"{name + ' agreement':<44} {agree:>8} / {len(recorded)}")
+
+
+def _substring_bloom_level(question: str) -> str:
+    """detect_bloom_level before compilation (substring matching), kept as the baseline"""
+    q = question.lower()
+    tokens = re.findall(r'\b[a-z]+\b', q)
+    first_word = tokens[0] if tokens else ""
+    bloom_keywords = {
+        "Remember":   ["define", "recall", "list", "what", "when"],
+        "Understand": ["explain", "describe", "summarize", "interpret"],
+        "Apply":      ["apply", "use", "solve", "calculate", "determine"],
+        "Analyze":    ["analyze", "compare", "contrast", "distinguish"],
+        "Evaluate":   ["evaluate", "justify", "argue", "validate", "assess"],
+        "Create":     ["design", "create", "develop", "propose"]
+    }
+    for level, words in bloom_keywords.items():
+        if first_word in words:
+            return level
+    for level, words in bloom_keywords.items():
+        if any(w in q for w in words):
+            return level
+    if "why" in q or "reason" in q:
+        return "Evaluate"
+    if "how" in q:
+        return "Analyze"
+    return "Unclassified"
+
+
+def _sample_questions():
+    """Question texts from the bundled sample outputs in data/"""
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    with open(os.path.join(data_dir, "mapped_questions.json"), encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+    with open(os.path.join(data_dir, "generated_mcqs_Data_Structures_UNIT_3.txt"), encoding="utf-8") as f:
+        questions += [line[len("Question:"):].strip() for line in f if line.startswith("Question:")]
+    return questions
+
+
+def bench_bloom():
+    """Substring Bloom rules vs compiled whole-word classifier"""
+    from mcq_core import detect_bloom_levels_batch
+
+    print_bench("Bloom Level Detection (sample questions)")
+    sample = _sample_questions()
+    for label, questions in (("sample", sample * (100_000 // len(sample))),
+                             ("synthetic", _synthetic_questions(100_000)[0])):
+        n = len(questions)
+        start = time.perf_counter()
+        baseline = [_substring_bloom_level(q) for q in questions]
+        report(f"substring rules, {n:,} {label}", n, time.perf_counter() - start, "questions")
+
+        start = time.perf_counter()
+        compiled = detect_bloom_levels_batch(questions)
+        report(f"compiled batch, {n:,} {label}", n, time.perf_counter() - start, "questions")
+
+    baseline = [_substring_bloom_level(q) for q in sample]
+    compiled = detect_bloom_levels_batch(sample)
+    changed = [(q, a, b) for q, a, b in zip(sample, baseline, compiled) if a != b]
+    print(f"{'sample questions relabelled':<44} {len(changed):>8} / {len(sample)}")
+    for question, old, new in changed:
+        print(f"  {old} -> {new}: {question}")
+
+
+def _regex_parse_mcqs(raw_text: str):
+    """parse_mcqs before the single-pass parser (one search per field), kept as the baseline"""
+    def extract_option(block, opt, next_opt):
+        if next_opt:
+            stop = rf"(?=\s*{next_opt}\)\s|\s*Correct Answer:)"
+        else:
+            stop = rf"(?=\s*Correct Answer:)"
+        m = re.search(rf"{opt}\)\s*(.*?){stop}", block, re.DOTALL | re.IGNORECASE)
+        return " ".join(m.group(1).split()) if m else ""
+
+    parsed = []
+    for block in raw_text.replace("\r\n", "\n").split("## MCQ"):
+        q_match = re.search(r"Question:\s*(.*?)(?=\n\s*A\))", block, re.DOTALL)
+        if not q_match:
+            continue
+        labels = ["A", "B", "C", "D"]
+        options = {}
+        for i, opt in enumerate(labels):
+            text = extract_option(block, opt, labels[i + 1] if i + 1 < len(labels) else None)
+            if text:
+                options[opt] = text
+        c_match = re.search(r"Correct Answer[:\s]*\(?([A-D])\)?", block, re.IGNORECASE)
+        if len(options) == 4 and c_match:
+            parsed.append((" ".join(q_match.group(1).split()), options, c_match.group(1).upper()))
+    return parsed
+
+
+def bench_mcq_parser():
+    """Per-field regex searches vs single-pass label scan; malformed-output fixtures"""
+    import logging
+    from mcq_core import parse_mcqs
+
+    print_bench("MCQ Parser")
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    with open(os.path.join(data_dir, "generated_mcqs_Data_Structures_UNIT_3.txt"), encoding="utf-8") as f:
+        sample = f.read()
+    raw = sample * 2_000
+    n = raw.count("## MCQ")
+
+    start = time.perf_counter()
+    baseline = _regex_parse_mcqs(raw)
+    report(f"per-field regex, {n:,} MCQs", n, time.perf_counter() - start, "MCQs")
+
+    start = time.perf_counter()
+    single = parse_mcqs(raw)
+    report(f"single pass, {n:,} MCQs", n, time.perf_counter() - start, "MCQs")
+    agree = sum(old == new[1:] for old, new in zip(baseline, single))
+    print(f"{'agreement on sample output':<44} {agree:>8} / {len(baseline)}")
+
+    with open(os.path.join(data_dir, "mcq_parser_fixtures.json"), encoding="utf-8") as f:
+        fixtures = json.load(f)
+    logging.disable(logging.WARNING)
+    try:
+        passed = {"per-field regex": 0, "single pass": 0}
+        for case in fixtures:
+            expected = [(e["question"], e["options"], e["correct"]) for e in case["expected"]]
+            if _regex_parse_mcqs(case["raw"]) == expected:
+                passed["per-field regex"] += 1
+            got = [p[1:] for p in parse_mcqs(case["raw"])]
+            if got == expected:
+                passed["single pass"] += 1
+            else:
+                print(f"  FAILED {case['name']}: {got}")
+    finally:
+        logging.disable(logging.NOTSET)
+    for label, count in passed.items():
+        print(f"{label + ' fixtures passed':<44} {count:>8} / {len(fixtures)}")
+
+
+BENCHMARKS = {
+    "rate_limiter": bench_rate_limiter,
+    "docx_extraction": bench_docx_extraction,
+    "co_mapping": bench_co_mapping,
+    "co_scoring": bench_co_scoring,
+    "bloom": bench_bloom,
+    "mcq_parser": bench_mcq_parser,
+}
+
+
+def run_benchmarks(names=None):
+    """Run the selected (default: all) benchmarks"""
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark '{name}'. Available: {', '.join(BENCHMARKS)}")
+            continue
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    run_benchmarks(sys.argv[1:])
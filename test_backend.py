@@ -0,0 +1,556 @@
+"""
+Offline tests for backend modules (no server or Groq key needed)
+Run: python -m pytest test_backend.py
+"""
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+# The fake Groq endpoints below have no upstream quota to respect
+os.environ.setdefault("GROQ_REQUESTS_PER_MINUTE", "100000")
+os.environ.setdefault("GROQ_TOKENS_PER_MINUTE", "100000000")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+
+# ===================================================================
+#                       TEXT NORMALIZATION
+# ===================================================================
+
+TEXTBOOK_LINES = [
+    "The stack-based parser design in Fig. 3 uses a single lookahead token.",
+    "Students can search the catalog in the library for older editions.",
+    "A web application must log in the user before issuing a session token.",
+    "Every node in a heap must share this property with its children.",
+    "Subscribers receive updates when the observed object changes state.",
+    "Cookies store small amounts of state on the client between requests.",
+    "Next, the algorithm compares the key with the root of the subtree.",
+]
+
+
+def test_normalize_keeps_document_prose():
+    """Wrapped PDF lines that mention web words are course content"""
+    from normalize import TextNormalizer
+
+    text = TextNormalizer().normalize(["\n".join(TEXTBOOK_LINES)], source="syllabus.pdf")
+    assert text.splitlines() == TEXTBOOK_LINES
+
+
+def test_normalize_strips_chrome_from_web_pages_only():
+    """Whole-line site chrome is dropped for URLs; prose lines still survive"""
+    from normalize import TextNormalizer
+
+    chrome = ["Accept all cookies", "Skip to main content", "Sign in", "Share this",
+              "© 2024 Example Univ. All rights reserved.", "Back to top", "Menu"]
+    page = "\n".join(chrome[:4] + TEXTBOOK_LINES + chrome[4:])
+    normalizer = TextNormalizer()
+    assert normalizer.normalize([page], source="https://example.edu", web=True).splitlines() == TEXTBOOK_LINES
+    assert normalizer.normalize([page], source="notes.txt").splitlines() == chrome[:4] + TEXTBOOK_LINES + chrome[4:]
+
+
+def test_normalize_keeps_code_and_tables():
+    """Braces, numeric cells, repeated rows and indentation survive; edge chrome does not"""
+    from normalize import TextNormalizer
+
+    header = "Data Structures Using C - Lecture Notes and Examples"
+    code = ["int pop(Stack *s) {", "    if (s->top == -1) {", "        return -1;", "    }",
+            "    return s->items[s->top--];", "}"]
+    table = ["Operation    Time", "push         1", "pop          1", "2", "push         1"]
+    pages = [
+        "\n".join([header, "Listing 4.1"] + code + ["Listing 4.2"] + code + ["Table 4.1"] + table + ["- 12 -"]),
+        "\n".join([header, "Further examples follow."] + code + ["-----", "13"]),
+    ]
+    text = TextNormalizer().normalize(pages, source="notes.pdf")
+    assert text.count("    if (s->top == -1) {") == 3
+    assert text.count("\n}\n") == 3
+    assert "Operation Time\npush 1\npop 1\n2\npush 1\n" in text
+    assert text.count(header) == 1
+    assert "- 12 -" not in text and "-----" not in text and "\n13\n" not in text
+
+
+# ===================================================================
+#                    STREAMED GENERATION EVENTS
+# ===================================================================
+
+def _fake_completion(prompt: str) -> str:
+    """Distinct well-formed MCQs, as many as the prompt asks for"""
+    import hashlib
+    import re
+    counts = re.findall(r"- CO(\d+): exactly (\d+) MCQs", prompt)
+    if not counts:
+        counts = [("", re.search(r"Generate exactly (\d+) MCQs", prompt).group(1))]
+    blocks = []
+    for co, n in counts:
+        tag = f" [CO{co}]" if co else ""
+        for i in range(int(n)):
+            digest = hashlib.sha256(f"{prompt}{co}{i}".encode()).hexdigest()
+            words = " ".join(
+                "".join(chr(97 + int(c, 16)) for c in digest[k:k + 6]) for k in range(0, 36, 6)
+            )
+            blocks.append(
+                f"## MCQ{tag}\nQuestion: Which {words} applies?\n"
+                f"A) first {i}\nB) second {i}\nC) third {i}\nD) fourth {i}\nCorrect Answer: B\n\n"
+            )
+    return "".join(blocks)
+
+
+def _sse_handler(truncate_after: int = 0):
+    """
+    OpenAI-style SSE endpoint streaming the fake completion in small chunks
+    truncate_after > 0 drops the connection after that many MCQs, before [DONE]
+    """
+    async def handler(request):
+        import json
+        from aiohttp import web
+        body = await request.json()
+        text = _fake_completion(body["messages"][0]["content"])
+        if truncate_after:
+            text = "## MCQ".join(text.split("## MCQ")[:truncate_after + 1])
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        try:
+            for i in range(0, len(text), 23):
+                chunk = {"choices": [{"delta": {"content": text[i:i + 23]}}]}
+                await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            if not truncate_after:
+                await resp.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            pass  # Client cancelled once its quota was met
+        return resp
+    return handler
+
+
+async def _with_fake_groq(monkeypatch, handler, fn):
+    """Run fn(session) against a local endpoint serving handler"""
+    from aiohttp import ClientSession, web
+    from config import settings
+
+    app = web.Application()
+    app.router.add_post("/chat", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(settings, "groq_api_url", f"http://127.0.0.1:{port}/chat")
+    try:
+        async with ClientSession() as session:
+            return await fn(session)
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.parametrize("method", ["tfidf", "jaccard"])
+def test_streamed_generation_emits_every_mcq(monkeypatch, method):
+    """on_event receives each mapped MCQ, not just the first of each stream"""
+    import asyncio
+    from config import settings
+    from mcq_core import generate_balanced_mcqs
+
+    monkeypatch.setattr(settings, "co_mapping_method", method)
+    monkeypatch.setattr(settings, "llm_cache_enabled", False)
+    monkeypatch.setattr(settings, "llm_streaming_enabled", True)
+    co_list = ["CO1: Apply stack and queue operations", "CO2: Analyze tree and graph traversal"]
+    total = 8
+    events = []
+
+    async def run(session):
+        return await generate_balanced_mcqs(
+            "Stacks, queues, trees and graphs. " * 50, co_list, total,
+            on_event=lambda kind, payload: events.append((kind, payload)), session=session
+        )
+
+    result = asyncio.run(_with_fake_groq(monkeypatch, _sse_handler(), run))
+    streamed = [payload for kind, payload in events if kind == "mcq"]
+    assert len(result["mapped_questions"]) == total
+    assert len(streamed) == total
+    assert all(m["mapped_co"] in ("CO1", "CO2") and m["bloom_level"] for m in streamed)
+
+
+def test_quota_counts_only_unique_mcqs():
+    """Repeats of a streamed or already pooled MCQ don't satisfy the quota"""
+    from mcq_core import MCQPool, StreamQuota, parse_mcqs
+
+    mcqs = [parse_mcqs(f"## MCQ\nQuestion: {q}?\nA) a\nB) b\nC) c\nD) d\nCorrect Answer: A\n")[0]
+            for q in ("What does a stack pop return", "Which traversal visits the root first")]
+    quota = StreamQuota([2])
+    for parsed in (mcqs[0], mcqs[0], mcqs[0]):
+        quota.accept(0, parsed)
+    assert not quota.satisfied([0])
+    quota.accept(0, mcqs[1])
+    assert quota.satisfied([0])
+
+    pool = MCQPool(1)
+    pool.add(0, mcqs[0])
+    top_up = pool.quota([1])
+    top_up.accept(0, mcqs[0])
+    assert not top_up.satisfied([0])
+
+
+def _parser_fixtures():
+    import json
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "mcq_parser_fixtures.json")) as f:
+        return json.load(f)
+
+
+def test_parser_fixtures():
+    """Every recorded LLM output variant parses to its expected MCQs"""
+    from mcq_core import parse_tagged_mcqs
+
+    for case in _parser_fixtures():
+        got = [{"co": co, "question": p[1], "options": p[2], "correct": p[3]}
+               for co, p in parse_tagged_mcqs(case["raw"])]
+        assert got == case["expected"], case["name"]
+
+
+def test_incremental_parser_matches_batch_parser():
+    """Streaming any fixture in small chunks parses like the whole text"""
+    from mcq_core import IncrementalMCQParser, parse_tagged_mcqs
+
+    cases = _parser_fixtures()
+    options = "A) a\nB) b\nC) c\nD) d\n"
+    cases.append({"name": "answer_letter_on_next_line_streamed",
+                  "raw": f"## MCQ\nQuestion: Q1?\n{options}Correct Answer:\n B\n"
+                         f"## MCQ\nQuestion: Q2?\n{options}Correct Answer:\n\nA\n",
+                  "expected": [{"correct": "B"}, {"correct": "A"}]})
+    for case in cases:
+        for size in (1, 7):
+            parser = IncrementalMCQParser()
+            streamed = []
+            for i in range(0, len(case["raw"]), size):
+                streamed.extend(parser.feed(case["raw"][i:i + size]))
+            streamed.extend(parser.close())
+            expected = parse_tagged_mcqs(case["raw"])
+            assert [p[1:] for _, p in streamed] == [p[1:] for _, p in expected], (case["name"], size)
+            assert [p[3] for _, p in streamed] == [e["correct"] for e in case["expected"]], (case["name"], size)
+
+
+# ===================================================================
+#                          CO MAPPING
+# ===================================================================
+
+def test_unknown_co_mapping_method_fails_at_load(monkeypatch):
+    """A typo in CO_MAPPING_METHOD is a settings error, not a failure mid-generation"""
+    from pydantic import ValidationError
+    from config import Settings
+
+    monkeypatch.setenv("CO_MAPPING_METHOD", "tf-idf")
+    with pytest.raises(ValidationError):
+        Settings()
+    monkeypatch.setenv("CO_MAPPING_METHOD", "jaccard")
+    assert Settings().co_mapping_method == "jaccard"
+
+
+# ===================================================================
+#                    PAGE / SECTION SELECTION
+# ===================================================================
+
+def test_short_section_is_selected():
+    """A real section shorter than a page still ends at the next heading"""
+    from extraction import TextSelector
+
+    body = "Binary trees, traversals and expression trees with worked examples."
+    selector = TextSelector("Unit 3")
+    for page in ("Unit 2 Stacks\nPush and pop.", f"Unit 3 Trees\n{body}\nUnit 4 Graphs\nBFS."):
+        if selector.feed(page):
+            break
+    assert selector.text("Unit 3") == f"Unit 3 Trees\n{body}\n"
+
+
+def test_table_of_contents_is_skipped():
+    """TOC entries (leaders or page numbers) never count as the section"""
+    from extraction import ExtractionError, TextSelector
+
+    selector = TextSelector("Unit 3")
+    for page in ("Contents\nUnit 3 Trees ........ 20\nUnit 4 Graphs ........ 30",
+                 "Unit 1 Basics 1\nUnit 3 Trees 20\nUnit 4 Graphs 30",
+                 "UNIT 3 TREES 9\nHeaps and priority queues.\nUNIT 4 GRAPHS 9\nDFS."):
+        if selector.feed(page):
+            break
+    assert selector.text("Unit 3") == "UNIT 3 TREES 9\nHeaps and priority queues.\n"
+
+    selector = TextSelector("Unit 3")
+    for page in ("Unit 3 Trees … 20", "Unit 4 Graphs … 30"):
+        selector.feed(page)
+    with pytest.raises(ExtractionError):
+        selector.text("Unit 3")
+
+
+def test_empty_selection_is_an_error():
+    """Nothing selected must not reach the prompt as empty context"""
+    from extraction import ExtractionError, TextSelector
+
+    selector = TextSelector()
+    selector.feed("")
+    with pytest.raises(ExtractionError):
+        selector.text()
+
+
+def test_page_range_outside_document_is_an_error(tmp_path):
+    """'500-600' on a short PDF is rejected instead of yielding empty text"""
+    import asyncio
+    from fpdf import FPDF
+    from extraction import ExtractionError, TextExtractor, parse_page_ranges
+
+    path = str(tmp_path / "short.pdf")
+    pdf = FPDF()
+    pdf.set_font("Helvetica", size=10)
+    for i in range(3):
+        pdf.add_page()
+        pdf.cell(0, 6, f"Page {i + 1} text about stacks and queues.")
+    pdf.output(path)
+
+    extractor = TextExtractor(workers=1, timeout_seconds=60, memory_limit_mb=0, pages_per_task=2)
+    try:
+        assert "Page 2" in asyncio.run(extractor.extract(path, parse_page_ranges("2")))[0]
+        with pytest.raises(ExtractionError, match="outside the document"):
+            asyncio.run(extractor.extract(path, parse_page_ranges("500-600")))
+    finally:
+        extractor.shutdown()
+
+
+def test_token_budget_applies_to_selections_only(tmp_path):
+    """A whole document is read in full; a cut selection is reported"""
+    import asyncio
+    from extraction import TextExtractor
+
+    path = str(tmp_path / "book.txt")
+    body = "Stacks push and pop elements in last-in first-out order. " * 40
+    with open(path, "w") as f:
+        f.write(f"Unit 1 Stacks\n{body}\nUnit 2 Queues\n{body}\n")
+    extractor = TextExtractor(workers=1, timeout_seconds=60, memory_limit_mb=0, pages_per_task=2, max_tokens=50)
+    try:
+        text, truncated = asyncio.run(extractor.extract(path))
+        assert "Unit 2 Queues" in text and not truncated
+        text, truncated = asyncio.run(extractor.extract(path, section="Unit 1"))
+        assert len(text) < len(body) and truncated
+        assert extractor.stats()["truncated"] == 1
+    finally:
+        extractor.shutdown()
+
+
+def test_timeout_does_not_fail_other_extractions(tmp_path):
+    """A stuck document retires its pool without killing extractions sharing it"""
+    import asyncio
+    from extraction import ExtractionError, TextExtractor
+
+    stuck, slow = str(tmp_path / "stuck.txt"), str(tmp_path / "slow.txt")
+    os.mkfifo(stuck)  # Reading blocks until a writer appears
+    os.mkfifo(slow)
+    (tmp_path / "fast.txt").write_text("Queues are FIFO.\n")
+    extractor = TextExtractor(workers=2, timeout_seconds=6, memory_limit_mb=0, pages_per_task=2)
+
+    async def run():
+        first = asyncio.create_task(extractor.extract(stuck))
+        await asyncio.sleep(2)
+        second = asyncio.create_task(extractor.extract(slow))
+        with pytest.raises(ExtractionError, match="timed out"):
+            await first
+        assert extractor.stats()["retired_pools"] == 1
+        assert "Queues" in (await extractor.extract(str(tmp_path / "fast.txt")))[0]  # Fresh pool
+        with open(slow, "w") as f:
+            f.write("Stacks are LIFO.\n")
+        assert "Stacks" in (await second)[0]
+        assert extractor.stats()["retired_pools"] == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        extractor.shutdown()
+
+
+# ===================================================================
+#                       LLM RESPONSE CACHE
+# ===================================================================
+
+def test_llm_cache_opens_lazily(tmp_path):
+    """Constructing the cache (at import) creates no database file"""
+    from llm_cache import LLMResponseCache
+
+    path = tmp_path / "llm.db"
+    cache = LLMResponseCache(str(path), max_bytes=1024 * 1024)
+    assert not path.exists()
+    cache.set(cache.key("m", "p", 0.0), "m", 0.0, "response")
+    assert path.exists() and cache.get(cache.key("m", "p", 0.0)) == "response"
+
+
+def test_broken_stream_is_not_cached(monkeypatch, tmp_path):
+    """Only completions that reached [DONE] are stored"""
+    import asyncio
+    import mcq_core
+    from config import settings
+    from llm_cache import LLMResponseCache
+
+    monkeypatch.setattr(settings, "llm_cache_enabled", True)
+    monkeypatch.setattr(settings, "llm_streaming_enabled", True)
+    cache = LLMResponseCache(str(tmp_path / "llm.db"), max_bytes=1024 * 1024)
+    monkeypatch.setattr(mcq_core, "llm_cache", cache)
+    prompt = mcq_core._build_co_prompt("Stacks and queues. " * 20, "CO1: Apply stacks", 5)
+
+    async def request(session):
+        return await mcq_core._request_mcqs(session, prompt, "CO1", [0], None)
+
+    partial = asyncio.run(_with_fake_groq(monkeypatch, _sse_handler(truncate_after=2), request))
+    assert len(mcq_core.parse_mcqs(partial)) == 2
+    assert cache.stats()["entries"] == 0
+
+    complete = asyncio.run(_with_fake_groq(monkeypatch, _sse_handler(), request))
+    assert len(mcq_core.parse_mcqs(complete)) == 5
+    assert cache.stats()["entries"] == 1
+
+
+def test_quota_cancelled_stream_is_not_cached(monkeypatch, tmp_path):
+    """A stream stopped once the quota is met is shorter than its prompt asked"""
+    import asyncio
+    import mcq_core
+    from config import settings
+    from llm_cache import LLMResponseCache
+
+    monkeypatch.setattr(settings, "llm_cache_enabled", True)
+    monkeypatch.setattr(settings, "llm_streaming_enabled", True)
+    cache = LLMResponseCache(str(tmp_path / "llm.db"), max_bytes=1024 * 1024)
+    monkeypatch.setattr(mcq_core, "llm_cache", cache)
+    prompt = mcq_core._build_co_prompt("Stacks and queues. " * 20, "CO1: Apply stacks", 5)
+
+    async def request(session):
+        return await mcq_core._request_mcqs(session, prompt, "CO1", [0], mcq_core.StreamQuota([2]))
+
+    partial = asyncio.run(_with_fake_groq(monkeypatch, _sse_handler(), request))
+    assert len(mcq_core.parse_mcqs(partial)) == 2
+    assert cache.stats()["entries"] == 0
+
+
+# ===================================================================
+#                          MCQ CACHE
+# ===================================================================
+
+def test_cache_key_hashes_content_in_slices():
+    """Same key as hashing the whole encoding, without a document-sized copy"""
+    import hashlib
+    import tracemalloc
+    from cache import MCQCache
+    from state import LocalStateBackend
+
+    content = "Stacks and queues — ordered collections. " * 200_000  # ~8 MB, non-ASCII
+    cache = MCQCache(LocalStateBackend())
+    whole = hashlib.sha256(content.encode())
+    for co in sorted(["CO2: Trees", "CO1: Stacks"]):
+        whole.update(b"\0" + co.encode())
+    whole.update(b"\0" + b"10")
+    tracemalloc.start()
+    key = cache.key(content, ["CO2: Trees", "CO1: Stacks"], 10)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert key == whole.hexdigest()[:16]
+    assert peak < 1024 * 1024
+
+
+# ===================================================================
+#                          SHARED STATE
+# ===================================================================
+
+def test_sqlite_state_fails_open_under_lock_contention(tmp_path):
+    """A worker holding the write lock can't stall another worker's event loop"""
+    import sqlite3
+    import time
+    from state import SQLiteStateBackend
+
+    path = str(tmp_path / "state.db")
+    backend = SQLiteStateBackend(path)
+    backend.cache_set("k", {"v": 1}, 10, time.time(), time.time() + 60, 10, 1000)
+    holder = sqlite3.connect(path, isolation_level=None)
+    holder.execute("BEGIN IMMEDIATE")
+    try:
+        start = time.perf_counter()
+        assert backend.rate_record("client", time.monotonic(), [(60.0, 1)]) is None
+        assert backend.rate_record("client", time.monotonic(), [(60.0, 1)]) is None  # Admitted
+        assert backend.cache_get("k", time.time()) is None
+        assert time.perf_counter() - start < 1.0
+        assert backend.cache_stats()["busy"] == 3
+    finally:
+        holder.execute("ROLLBACK")
+    assert backend.cache_get("k", time.time()) == {"v": 1}
+    assert backend.rate_record("client", time.monotonic(), [(60.0, 1)]) is None
+    assert backend.rate_record("client", time.monotonic(), [(60.0, 1)]) == 0
+
+
+# ===================================================================
+#                         BACKGROUND JOBS
+# ===================================================================
+
+def test_job_store_opens_lazily(tmp_path):
+    """Constructing the store (at import) creates no database file"""
+    from jobs import JobStore
+
+    path = tmp_path / "jobs.db"
+    store = JobStore(str(path))
+    assert not path.exists()
+    store.create("job1")
+    assert path.exists() and store.get("job1")["status"] == "queued"
+
+
+def test_job_mcqs_are_written_in_batches(tmp_path):
+    """Streamed MCQs are committed per batch, and reads in the same process see all of them"""
+    from jobs import MCQ_FLUSH_BATCH, JobStore
+
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.create("job1")
+    commits = []
+    conn = store._conn
+    store._db = type("Conn", (), {
+        "execute": lambda self, *a: conn.execute(*a),
+        "executemany": lambda self, *a: conn.executemany(*a),
+        "commit": lambda self: commits.append(1) or conn.commit(),
+    })()
+
+    for i in range(MCQ_FLUSH_BATCH + 3):
+        store.add_mcq("job1", {"question": f"Q{i}"})
+    assert len(commits) == 1
+    job = store.get("job1")
+    assert [m["question"] for m in job["partial_mcqs"]] == [f"Q{i}" for i in range(MCQ_FLUSH_BATCH + 3)]
+
+
+def test_buffered_mcqs_reach_other_workers_on_a_timer(tmp_path):
+    """Another process sharing jobs.db sees a short batch within MCQ_FLUSH_SECONDS"""
+    import asyncio
+    from jobs import MCQ_FLUSH_SECONDS, JobQueue, JobStore
+
+    path = str(tmp_path / "jobs.db")
+    store, other = JobStore(path), JobStore(path)
+    queue = JobQueue(store, workers=1)
+
+    async def run():
+        async def handler(job_id, payload):
+            return {}
+        queue.start(handler)
+        store.create("job1")
+        store.add_mcq("job1", {"question": "Q0"})
+        assert other.get("job1")["partial_mcqs"] == []
+        await asyncio.sleep(MCQ_FLUSH_SECONDS * 1.5)
+        assert [m["question"] for m in other.get("job1")["partial_mcqs"]] == ["Q0"]
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_expired_jobs_are_purged_periodically(tmp_path):
+    """The sweeper purges on its interval, not only at startup"""
+    import asyncio
+    from jobs import JobQueue, JobStore
+
+    store = JobStore(str(tmp_path / "jobs.db"))
+    queue = JobQueue(store, workers=1, retention_hours=0, purge_interval_seconds=0.05)
+
+    async def run():
+        async def handler(job_id, payload):
+            return {}
+        queue.start(handler)
+        store.create("old")
+        store.add_mcq("old", {"question": "Q"})
+        await asyncio.sleep(0.2)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert store.get("old") is None
+    assert queue.stats()["purged"] >= 1
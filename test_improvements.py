@@ -209,6 +209,8 @@ def test_stats_endpoint():
     data = response.json()
     assert "cache_size" in data
     assert "timestamp" in data
+    for counter in ("hits", "misses", "evictions"):
+        assert counter in data["cache"]
     print("✅ Statistics endpoint working")
 
 
@@ -295,6 +297,66 @@ def test_file_upload():
             test_file.unlink()
 
 
+def test_streaming_generation():
+    """Test that /generate/stream pushes MCQs before the final result"""
+    print_test("Streaming Generation (SSE)")
+    
+    events = []
+    with requests.post(
+        f"{BASE_URL}/generate/stream",
+        data={
+            "url_input": "https://en.wikipedia.org/wiki/Queue_(abstract_data_type)",
+            "total_questions": 5,
+            "co_list": "CO1: Queue operations\nCO2: Queue applications"
+        },
+        stream=True
+    ) as response:
+        print(f"Status: {response.status_code}")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                events.append(line.split(":", 1)[1].strip())
+    
+    print(f"Events: {events}")
+    assert "mcq" in events
+    assert events[-1] == "complete"
+    assert events.index("mcq") < events.index("complete")
+    print("✅ Streaming generation working correctly")
+
+
+def test_async_job():
+    """Test that async_mode returns a job ID that can be polled to completion"""
+    print_test("Background Generation Job")
+    
+    response = requests.post(
+        f"{BASE_URL}/generate",
+        data={
+            "url_input": "https://en.wikipedia.org/wiki/Stack_(abstract_data_type)",
+            "total_questions": 5,
+            "co_list": "CO1: Stack operations\nCO2: Stack applications",
+            "async_mode": "true"
+        }
+    )
+    print(f"Status: {response.status_code}")
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    
+    for _ in range(60):
+        job = requests.get(f"{BASE_URL}/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(2)
+    
+    print(f"Job {job_id}: {job['status']}, {len(job['partial_mcqs'])} partial MCQs")
+    assert job["status"] == "done"
+    assert job["mapped_mcqs"]
+    assert job["txt_filename"]
+    assert requests.get(f"{BASE_URL}/jobs/unknown").status_code == 404
+    print("✅ Background jobs working correctly")
+
+
 def test_parallel_generation():
     """Test that parallel generation is faster than sequential"""
     print_test("Parallel API Calls")
@@ -342,6 +404,8 @@ def run_all_tests():
         ("Compression", test_compression),
         ("File Upload", test_file_upload),
         ("Parallel Generation", test_parallel_generation),
+        ("Streaming Generation", test_streaming_generation),
+        ("Background Job", test_async_job),
     ]
     
     passed = 0